@@ -0,0 +1,645 @@
+import os
+import math
+import tempfile
+import threading
+from fractions import Fraction
+from functools import lru_cache
+from time import perf_counter
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import soundfile as sf
+
+# ----------- Polyphase resampler -------------
+@lru_cache(maxsize=32)
+def polyphase_bank(src, dst, taps=32):
+    """
+    Kaiser-windowed sinc lowpass for src -> dst, split into L phases of
+    `taps` coefficients (time-reversed for a dot product against the input).
+    Cached per rate pair; returns (L, M, bank) with dst/src = L/M.
+    """
+    g = math.gcd(src, dst)
+    up, down = dst // g, src // g
+    n = taps * up
+    cutoff = 0.5 / max(up, down) * 0.94
+    m = np.arange(n) - (n - 1) // 2  # integer centre so resample() can cancel the delay exactly
+    h = 2 * cutoff * np.sinc(2 * cutoff * m) * np.kaiser(n, 8.6) * up
+    bank = h.reshape(taps, up).T[:, ::-1]
+    return up, down, np.ascontiguousarray(bank, dtype=np.float32)
+
+
+class Resampler:
+    """
+    Streaming rational resampler. Filter history and phase carry over
+    between process() calls, so consecutive blocks join without seams.
+    `skip` drops that many upsampled positions at the start (used by
+    resample() to cancel the filter delay).
+    """
+    def __init__(self, src, dst, taps=32, skip=0):
+        self.src, self.dst = src, dst
+        self.up, self.down, self.bank = polyphase_bank(src, dst, taps)
+        self.taps = taps
+        self.history = np.zeros(taps - 1, dtype=np.float32)
+        self.t = (taps - 1) * self.up + skip  # next output, in upsampled steps from history[0]
+
+    def process(self, x):
+        if self.src == self.dst:
+            return np.asarray(x, dtype=np.float32)
+        buf = np.concatenate([self.history, np.asarray(x, dtype=np.float32)])
+        end = len(buf) * self.up
+        t = np.arange(self.t, end, self.down)
+        if len(t):
+            k, phase = np.divmod(t, self.up)
+            windows = sliding_window_view(buf, self.taps)[k - self.taps + 1]
+            y = np.einsum("nt,nt->n", self.bank[phase], windows)
+            self.t = int(t[-1]) + self.down
+        else:
+            y = np.zeros(0, dtype=np.float32)
+        keep = len(buf) - (self.taps - 1)
+        self.t -= keep * self.up
+        self.history = buf[keep:].copy()
+        return y
+
+    def latency(self):
+        """Filter delay in output samples."""
+        return (self.taps * self.up - 1) // 2 / self.down
+
+
+def resample(x, src, dst, taps=32):
+    """One-shot, delay-compensated resample of a whole block."""
+    if src == dst:
+        return np.asarray(x, dtype=np.float32)
+    up = polyphase_bank(src, dst, taps)[0]
+    r = Resampler(src, dst, taps, skip=(taps * up - 1) // 2)
+    y = r.process(np.concatenate([np.asarray(x, dtype=np.float32), np.zeros(taps, dtype=np.float32)]))
+    return y[:int(round(len(x) * dst / src))]
+
+# ----------- Lock-free SPSC ring buffer -------------
+class RingBuffer:
+    """
+    Single-producer/single-consumer float32 ring buffer.
+    Storage is preallocated; the producer only advances write_pos and the
+    consumer only advances read_pos, so neither side needs a lock.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buf = np.zeros(capacity, dtype=np.float32)
+        self.write_pos = 0
+        self.read_pos = 0
+        self.overruns = 0
+
+    def available(self):
+        return self.write_pos - self.read_pos
+
+    def space(self):
+        return self.capacity - self.available()
+
+    def write(self, x):
+        n = len(x)
+        space = self.space()
+        if n > space:
+            n = space
+            self.overruns += 1
+        start = self.write_pos % self.capacity
+        first = min(n, self.capacity - start)
+        self.buf[start:start + first] = x[:first]
+        self.buf[:n - first] = x[first:n]
+        self.write_pos += n  # publish only after the samples are in place
+        return n
+
+    def read_into(self, out):
+        n = min(len(out), self.available())
+        start = self.read_pos % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self.buf[start:start + first]
+        out[first:n] = self.buf[:n - first]
+        self.read_pos += n
+        return n
+
+    def clear(self):
+        self.read_pos = self.write_pos
+
+
+# ----------- Voice activity detection -------------
+class VoiceActivityDetector:
+    """
+    Energy + spectral-flatness VAD over frame_ms sub-frames, vectorised per
+    call. A sub-frame is speech when it is threshold_db above the tracked
+    noise floor (and above min_db) and its spectrum is not noise-flat.
+    Speech keeps the gate open for hangover_ms afterwards.
+    """
+    def __init__(self, samplerate, frame_ms=10, threshold_db=9.0, hangover_ms=300,
+                 min_db=-55.0, max_flatness=0.5, floor_rise_db=3.0):
+        self.samplerate = samplerate
+        self.frame = max(32, int(samplerate * frame_ms / 1000))
+        self.window = np.hanning(self.frame).astype(np.float32)
+        self.threshold_db = threshold_db
+        self.hangover = int(samplerate * hangover_ms / 1000)
+        self.min_db = min_db
+        self.max_flatness = max_flatness
+        self.floor_rise = floor_rise_db / samplerate  # dB per sample the floor may creep up
+        self.noise_db = None
+        self.hang_left = 0
+
+    def update(self, x, advance):
+        """Classify `x`; `advance` is how many new samples it covers since the last call."""
+        n = len(x) // self.frame * self.frame
+        if not n:
+            return self.hang_left > 0
+        frames = x[len(x) - n:].reshape(-1, self.frame)
+        db = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-12)
+        spec = np.abs(np.fft.rfft(frames * self.window, axis=1)) ** 2 + 1e-12
+        flatness = np.exp(np.mean(np.log(spec), axis=1)) / np.mean(spec, axis=1)
+        quietest = float(db.min())
+        if self.noise_db is None or quietest < self.noise_db:
+            self.noise_db = quietest
+        else:
+            self.noise_db += self.floor_rise * advance
+        active = (db > self.noise_db + self.threshold_db) & (db > self.min_db) & (flatness < self.max_flatness)
+        if active.any():
+            self.hang_left = self.hangover
+        else:
+            self.hang_left = max(0, self.hang_left - advance)
+        return bool(active.any()) or self.hang_left > 0
+
+    def noise_rms(self):
+        return 10 ** ((self.noise_db if self.noise_db is not None else self.min_db) / 20)
+
+
+# ----------- Phase-vocoder pitch shifter -------------
+@lru_cache(maxsize=8)
+def stft_window(n):
+    return np.hanning(n + 1)[:-1].astype(np.float32)
+
+
+class PitchShifter:
+    """
+    Built-in pitch/formant shifter. A phase vocoder time-stretches the block
+    by the pitch ratio (frames interpolated at fractional positions, true
+    bin frequencies re-accumulated, all frames at once in numpy) and the
+    polyphase resampler squeezes it back to its original length. With
+    preserve_formants the cepstrally smoothed spectral envelope is
+    pre-warped so the formants stay put (or move by formant_shift
+    semitones) while the harmonics shift. Stateless per call, so it drops
+    into LivePipeline as `process` at about a millisecond per window.
+    """
+    OVERLAP = 4
+
+    def __init__(self, frame_ms=32, preserve_formants=True, formant_shift=0.0, lifter_ms=1.5):
+        self.frame_ms = frame_ms
+        self.preserve_formants = preserve_formants
+        self.formant_shift = formant_shift
+        self.lifter_ms = lifter_ms
+
+    def envelope(self, mag, samplerate, n):
+        lifter = max(2, int(samplerate * self.lifter_ms / 1000))
+        cep = np.fft.irfft(np.log(mag + 1e-9), n, axis=1)
+        cep[:, lifter:n - lifter + 1] = 0
+        return np.exp(np.fft.rfft(cep, n, axis=1).real)
+
+    def shift(self, x, samplerate, semitones):
+        x = np.asarray(x, dtype=np.float32)
+        formant = self.formant_shift if self.preserve_formants else 0.0
+        if not len(x) or (not semitones and not formant):
+            return x.copy()
+        # Rational pitch ratio up/down, so the resampler can use a cached bank
+        ratio = Fraction(2.0 ** (semitones / 12)).limit_denominator(64)
+        up, down = ratio.numerator, ratio.denominator
+        n = 1 << max(6, int(round(math.log2(samplerate * self.frame_ms / 1000))))
+        hop = n // self.OVERLAP
+        win = stft_window(n)
+        padded = np.concatenate([np.zeros(n, np.float32), x, np.zeros(n, np.float32)])
+        spec = np.fft.rfft(sliding_window_view(padded, n)[::hop] * win, axis=1)
+        mag, phase = np.abs(spec), np.angle(spec)
+        bins = spec.shape[1]
+
+        # True per-hop phase advance of every bin
+        expected = 2 * np.pi * hop * np.arange(bins) / n
+        delta = np.diff(phase, axis=0, prepend=phase[:1]) - expected
+        advance = expected + delta - 2 * np.pi * np.round(delta / (2 * np.pi))
+
+        # Stretch by up/down: output frames sit at fractional analysis positions
+        steps = np.arange(0, len(mag) - 1, down / up)
+        i = steps.astype(int)
+        a = (steps - i)[:, None].astype(np.float32)
+        if self.preserve_formants:
+            env = self.envelope(mag, samplerate, n)
+            warp = np.minimum(np.arange(bins) * (up / down) / 2.0 ** (formant / 12), bins - 1)
+            mag = mag / env * env[:, np.rint(warp).astype(int)]
+        new_mag = mag[i] * (1 - a) + mag[i + 1] * a
+        synth = phase[0] + np.cumsum(np.concatenate([np.zeros((1, bins)), advance[i[:-1] + 1]]), axis=0)
+
+        # Identity phase locking: bins around each spectral peak keep their
+        # analysis phase offsets from the peak, so partials stay coherent
+        b = np.arange(bins)
+        peak = np.zeros(new_mag.shape, dtype=bool)
+        peak[:, 1:-1] = (new_mag[:, 1:-1] > new_mag[:, :-2]) & (new_mag[:, 1:-1] >= new_mag[:, 2:])
+        prev = np.maximum.accumulate(np.where(peak, b, 0), axis=1)
+        nxt = np.minimum.accumulate(np.where(peak, b, bins - 1)[:, ::-1], axis=1)[:, ::-1]
+        owner = np.where(b - prev <= nxt - b, prev, nxt)
+        rows = np.arange(len(new_mag))[:, None]
+        analysis = phase[i]
+        new_phase = synth[rows, owner] + analysis - analysis[rows, owner]
+        out = np.fft.irfft(new_mag * np.exp(1j * new_phase), n, axis=1).astype(np.float32) * win
+
+        # Overlap-add: output hop j sums quarter q of frame j - q
+        quarters = out.reshape(len(out), self.OVERLAP, hop)
+        y = np.zeros((len(out) + self.OVERLAP - 1, hop), dtype=np.float32)
+        for q in range(self.OVERLAP):
+            y[q:q + len(out)] += quarters[:, q]
+        y = y.reshape(-1) / np.float32(np.sum(win * win) / hop)
+        y = resample(y, up, down)
+        y = y[n:n + len(x)]
+        return y if len(y) == len(x) else np.pad(y, (0, len(x) - len(y)))
+
+
+# ----------- Instrumentation -------------
+class StageStats:
+    """
+    Histogram of one stage's durations (seconds) in log-spaced bins,
+    BINS_PER_DECADE per decade from 1 us to 10 s. add() is O(1) and
+    allocation-free, so it is safe on the audio thread; each stage has a
+    single writer and readers only take snapshots.
+    """
+    BINS_PER_DECADE = 10
+    LOW = -6  # log10 of the first edge
+    BINS = 70
+
+    def __init__(self):
+        self.counts = np.zeros(self.BINS, dtype=np.int64)
+        self.total = 0.0
+        self.count = 0
+        self.worst = 0.0
+
+    def add(self, seconds):
+        i = int(self.BINS_PER_DECADE * (math.log10(seconds) - self.LOW)) if seconds > 0 else 0
+        self.counts[min(max(i, 0), self.BINS - 1)] += 1
+        self.total += seconds
+        self.count += 1
+        if seconds > self.worst:
+            self.worst = seconds
+
+    @classmethod
+    def edge(cls, i):
+        return 10.0 ** (cls.LOW + i / cls.BINS_PER_DECADE)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q):
+        """Upper edge of the bin holding the q-th percentile (0..100)."""
+        counts = self.counts.copy()
+        n = counts.sum()
+        if not n:
+            return 0.0
+        i = int(np.searchsorted(np.cumsum(counts), q / 100 * n))
+        return min(self.edge(i + 1), self.worst)
+
+    def clear(self):
+        self.counts[:] = 0
+        self.total = self.worst = 0.0
+        self.count = 0
+
+
+class PipelineStats:
+    """
+    Per-stage timing histograms of a LivePipeline:
+    capture (audio callback), resample, vad, inference, output (crossfade,
+    output ring, monitor), step (a whole window, checked against the hop
+    deadline) and buffered (output ring depth in seconds, seen by the
+    callback).
+    """
+    STAGES = ("capture", "resample", "vad", "inference", "output", "step", "buffered")
+
+    def __init__(self):
+        self.stages = {name: StageStats() for name in self.STAGES}
+
+    def __getitem__(self, name):
+        return self.stages[name]
+
+    def add(self, name, seconds):
+        self.stages[name].add(seconds)
+
+    def clear(self):
+        for stage in self.stages.values():
+            stage.clear()
+
+    def summary(self):
+        """{stage: (count, mean, p50, p99, worst)} in seconds."""
+        return {
+            name: (st.count, st.mean(), st.percentile(50), st.percentile(99), st.worst)
+            for name, st in self.stages.items()
+        }
+
+
+# ----------- Real-time overlap-add pipeline -------------
+class LivePipeline:
+    """
+    Moves conversion out of the audio callback.
+    callback() only copies samples into/out of ring buffers; a worker thread
+    converts analysis windows of `window` samples every hop
+    (window * (1 - overlap)) and crossfades consecutive outputs over
+    `crossfade` samples. The last `lookahead` samples of each window are
+    context for the model and are only emitted by the next window.
+    monitor(input_hop, output_hop), if given, is called from the worker
+    after every window.
+    The callback runs at device_rate and windows are processed at samplerate
+    (the model rate); the worker converts between them with streaming
+    resamplers, so window sizes are in model-rate samples.
+    With a `vad` set, windows whose output region (plus the `preroll`
+    samples that follow it, at most lookahead + crossfade) holds no speech
+    skip `process` and are replaced according to gate_mode: "passthrough",
+    "noise" (comfort noise at the tracked floor) or "silence". Looking
+    ahead opens the gate before a word starts instead of clipping its onset.
+    Every stage is timed into `stats`; xruns (flags reported by the audio
+    driver), underruns, deadline misses (windows that took longer than a
+    hop) and process() errors are counted.
+    """
+    def __init__(self, process, window=4096, overlap=0.5, crossfade=512, lookahead=512,
+                 samplerate=16000, device_rate=None, capacity=None, monitor=None):
+        self.process = process
+        self.monitor = monitor
+        self.recorder = None
+        self.capacity = capacity
+        self.set_rates(samplerate, device_rate or samplerate)
+        self.data_ready = threading.Event()
+        self.running = False
+        self.thread = None
+        self.stats = PipelineStats()
+        self.underruns = 0
+        self.xruns = 0
+        self.deadline_misses = 0
+        self.errors = 0
+        self.last_error = None
+        self.vad = None
+        self.gate_mode = "passthrough"
+        self.preroll = 0
+        self.converted = 0
+        self.gated = 0
+        self.pending = None
+        self.apply_config(dict(window=window, overlap=overlap, crossfade=crossfade, lookahead=lookahead))
+
+    def set_rates(self, samplerate, device_rate):
+        """Only while stopped."""
+        self.samplerate = samplerate
+        self.device_rate = device_rate
+        capacity = self.capacity or device_rate * 2
+        self.inbuf = RingBuffer(capacity)
+        self.outbuf = RingBuffer(capacity)
+        self.scratch = np.zeros(capacity, dtype=np.float32)
+        self.backlog = np.zeros(0, dtype=np.float32)
+
+    def configure(self, **params):
+        # While running, the worker applies new params between windows so the
+        # buffers are never swapped out from under a step
+        merged = dict(self.pending or self.params)
+        merged.update(params)
+        merged = self.resolve(merged)
+        if self.running:
+            self.pending = merged
+        else:
+            self.apply_config(merged)
+        return merged
+
+    def resolve(self, params):
+        window = max(256, int(params["window"]))
+        overlap = min(max(float(params["overlap"]), 0.0), 0.9)
+        hop = max(64, int(window * (1 - overlap)))
+        # crossfade + lookahead must fit in the part of the window shared with the next one
+        crossfade = min(max(0, int(params["crossfade"])), hop, window - hop)
+        lookahead = min(max(0, int(params["lookahead"])), window - hop - crossfade)
+        return dict(window=window, overlap=overlap, hop=hop, crossfade=crossfade, lookahead=lookahead)
+
+    def apply_config(self, params):
+        self.params = self.resolve(params)
+        p = self.params
+        self.window, self.hop, self.crossfade, self.lookahead = p["window"], p["hop"], p["crossfade"], p["lookahead"]
+        self.frame = np.zeros(self.window, dtype=np.float32)
+        self.prev_tail = np.zeros(self.crossfade, dtype=np.float32)
+        fade = np.sin(0.5 * np.pi * (np.arange(self.crossfade) + 0.5) / max(self.crossfade, 1)) ** 2
+        self.fade_in = fade.astype(np.float32)
+        self.fade_out = (1.0 - fade).astype(np.float32)
+
+    def latency_ms(self):
+        p = self.pending or self.params
+        return 1000.0 * (p["hop"] + p["lookahead"] + p["crossfade"]) / self.samplerate
+
+    def end_to_end_ms(self, stream_latency=0.0):
+        """Mic-to-speaker estimate: algorithmic + mean output queue + driver latency (s)."""
+        return self.latency_ms() + 1000.0 * (self.stats["buffered"].mean() + stream_latency)
+
+    def reset_stats(self):
+        self.stats.clear()
+        self.underruns = self.xruns = self.deadline_misses = self.errors = 0
+        self.converted = self.gated = 0
+        self.last_error = None
+
+    def callback(self, indata, outdata, frames, time, status):
+        # Runs on the audio thread: copy in, copy out, nothing else
+        t0 = perf_counter()
+        if not self.running:
+            outdata.fill(0)
+            return
+        if status:
+            self.xruns += 1
+        self.inbuf.write(indata[:, 0])
+        self.data_ready.set()
+        n = self.outbuf.read_into(outdata[:, 0])
+        if n < frames:
+            outdata[n:, 0] = 0
+            self.underruns += 1
+        if self.recorder is not None:
+            self.recorder.write(indata[:, 0], outdata[:, 0])
+        self.stats.add("buffered", self.outbuf.available() / self.device_rate)
+        self.stats.add("capture", perf_counter() - t0)
+
+    def start(self):
+        self.inbuf.clear()
+        self.outbuf.clear()
+        self.backlog = np.zeros(0, dtype=np.float32)
+        self.reset_stats()
+        self.in_resampler = Resampler(self.device_rate, self.samplerate)
+        self.out_resampler = Resampler(self.samplerate, self.device_rate)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.data_ready.set()
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+            self.thread = None
+
+    def run(self):
+        while self.running:
+            if self.pending is not None:
+                params, self.pending = self.pending, None
+                self.apply_config(params)
+            n = self.inbuf.read_into(self.scratch)
+            if n:
+                t0 = perf_counter()
+                self.backlog = np.concatenate([self.backlog, self.in_resampler.process(self.scratch[:n])])
+                self.stats.add("resample", perf_counter() - t0)
+            if len(self.backlog) < self.hop:
+                self.data_ready.wait(0.05)
+                self.data_ready.clear()
+                continue
+            while len(self.backlog) >= self.hop and self.running:
+                self.step()
+
+    def step(self):
+        w, h, f, la = self.window, self.hop, self.crossfade, self.lookahead
+        t0 = perf_counter()
+        self.frame[:-h] = self.frame[h:]
+        self.frame[-h:] = self.backlog[:h]
+        self.backlog = self.backlog[h:]
+        end = w - la - f
+        speech = True
+        if self.vad is not None:
+            speech = self.vad.update(self.frame[end - h:min(w, end + self.preroll)], h)
+            t1 = perf_counter()
+            self.stats.add("vad", t1 - t0)
+        else:
+            t1 = t0
+        if speech:
+            self.converted += 1
+            try:
+                y = np.asarray(self.process(self.frame.copy()), dtype=np.float32)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = repr(e)
+                y = np.zeros(w, dtype=np.float32)
+            t2 = perf_counter()
+            self.stats.add("inference", t2 - t1)
+        else:
+            self.gated += 1
+            y = self.bypass()
+            t2 = perf_counter()
+        if len(y) < w:
+            y = np.pad(y, (0, w - len(y)))
+        seg = y[end - h:end].copy()
+        seg[:f] = seg[:f] * self.fade_in + self.prev_tail * self.fade_out
+        self.prev_tail[:] = y[end:end + f]
+        t3 = perf_counter()
+        out = self.out_resampler.process(seg)
+        t4 = perf_counter()
+        self.stats.add("resample", t4 - t3)
+        self.outbuf.write(out)
+        if self.monitor is not None:
+            self.monitor(self.frame[-h:].copy(), seg)
+        t5 = perf_counter()
+        self.stats.add("output", (t3 - t2) + (t5 - t4))
+        self.stats.add("step", t5 - t0)
+        if t5 - t0 > h / self.samplerate:
+            self.deadline_misses += 1
+
+    def bypass(self):
+        if self.gate_mode == "passthrough":
+            return self.frame.copy()
+        if self.gate_mode == "noise":
+            return (np.random.standard_normal(self.window) * self.vad.noise_rms()).astype(np.float32)
+        return np.zeros(self.window, dtype=np.float32)
+
+
+# ----------- Session recorder -------------
+class SessionRecorder:
+    """
+    Records the input and transformed streams of a whole LIVE session.
+    write() (audio thread) only copies into two preallocated ring buffers;
+    a background thread drains them into a raw interleaved float32 spill
+    file in flush_frames-sized sequential writes. Reading back goes through
+    a memory map, so RAM use stays constant however long the session runs.
+    """
+    INPUT, OUTPUT = 0, 1
+
+    def __init__(self, samplerate=16000, buffer_s=10, flush_frames=16384, directory=None):
+        self.samplerate = samplerate
+        self.flush_frames = flush_frames
+        capacity = int(samplerate * buffer_s)
+        self.rings = (RingBuffer(capacity), RingBuffer(capacity))
+        self.scratch = np.zeros((flush_frames, 2), dtype=np.float32)
+        self.column = np.zeros(flush_frames, dtype=np.float32)
+        fd, self.path = tempfile.mkstemp(prefix="voice-session-", suffix=".f32", dir=directory)
+        self.file = os.fdopen(fd, "wb")
+        self.frames = 0  # frames already on disk
+        self.wakeup = threading.Event()
+        self.recording = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, x_in, x_out):
+        self.rings[self.INPUT].write(x_in)
+        self.rings[self.OUTPUT].write(x_out)
+        if self.rings[self.OUTPUT].available() >= self.flush_frames:
+            self.wakeup.set()
+
+    @property
+    def dropped(self):
+        return self.rings[self.INPUT].overruns + self.rings[self.OUTPUT].overruns
+
+    def run(self):
+        while self.recording:
+            self.wakeup.wait(0.5)
+            self.wakeup.clear()
+            self.flush()
+        self.flush()
+        self.file.close()
+
+    def flush(self):
+        while True:
+            n = min(self.flush_frames, self.rings[0].available(), self.rings[1].available())
+            if not n:
+                return
+            for ch, ring in enumerate(self.rings):
+                ring.read_into(self.column[:n])
+                self.scratch[:n, ch] = self.column[:n]
+            self.scratch[:n].tofile(self.file)
+            self.file.flush()
+            self.frames += n
+
+    def stop(self):
+        """Flush what is buffered and close the spill file; the recording stays readable."""
+        if self.recording:
+            self.recording = False
+            self.wakeup.set()
+            self.thread.join()
+
+    def duration(self):
+        return self.frames / self.samplerate
+
+    def samples(self):
+        """(frames, 2) memory map of everything on disk so far."""
+        if not self.frames:
+            return np.zeros((0, 2), dtype=np.float32)
+        return np.memmap(self.path, dtype=np.float32, mode="r", shape=(self.frames, 2))
+
+    def export(self, path, channel=OUTPUT, block=1 << 16):
+        data = self.samples()
+        with sf.SoundFile(path, "w", samplerate=self.samplerate, channels=1) as out:
+            for start in range(0, len(data), block):
+                out.write(np.array(data[start:start + block, channel]))
+
+    def player(self, stop_exception, channel=OUTPUT):
+        """
+        OutputStream callback that plays the recording from disk; raises
+        stop_exception (sounddevice.CallbackStop) at the end.
+        """
+        data = self.samples()
+        pos = 0
+
+        def callback(outdata, frames, time, status):
+            nonlocal pos
+            chunk = data[pos:pos + frames, channel]
+            outdata[:len(chunk), 0] = chunk
+            outdata[len(chunk):, 0] = 0
+            pos += len(chunk)
+            if len(chunk) < frames:
+                raise stop_exception()
+        return callback
+
+    def close(self):
+        self.stop()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
@@ -1,181 +1,305 @@
 import sys
 import os
 import threading
-import time
-import traceback
-import json
+from collections import deque, namedtuple
 from datetime import datetime
 
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QTextEdit, QLineEdit, QPushButton, QLabel, QColorDialog, QMessageBox, QInputDialog
+    QLineEdit, QPushButton, QInputDialog,
+    QListView, QStyledItemDelegate, QAbstractItemView, QFileDialog, QTabWidget, QTabBar
 )
-from PySide6.QtCore import Qt, Signal, QTimer, QThread
-
-from tgcrypto import ige256_encrypt, ige256_decrypt
-from Crypto.Cipher import AES
-from Crypto.Random import get_random_bytes
-from PySide6.QtGui import QTextCursor
-import discord
-from discord.ext import tasks
-import tgcrypto
-from Crypto.Cipher import AES
-import discord
-import nest_asyncio
-
-# --- AES-256-GCM Parameters ---
-GCM_KEY = bytes.fromhex("adf0de6ffdf5484bd03f34264c1ed536646afd85eeaf6206fc7da262d7cf660f")
-GCM_IV  = bytes.fromhex("9569eece25da9445e3864e2a")  # 12 bytes for GCM
-
-# --- AES-256-IGE Parameters ---
-IGE_KEY = bytes.fromhex("64177f070bd33f66971ece6b61e5e71af1693e1e348f79cdd679b16c07329a86")
-IGE_IV  = bytes.fromhex("04af51b262ae169a499378397805feb097165222b0b582870be50ffa97d21053")
-
-# --- Discord Hardcoded credentials ---
-DISCORD_TOKEN = ""  # CHANGE THIS!
-DISCORD_CHANNEL_ID =   # CHANGE TO YOUR CHANNEL ID!
-
-# ---- ENCRYPTION FUNCTIONS ----
-def pad(data):
-    pad_len = 16 - (len(data) % 16)
-    return data + bytes([pad_len] * pad_len)
-
-def unpad(data):
-    pad_len = data[-1]
-    if not 1 <= pad_len <= 16:
-        raise ValueError("Invalid padding")
-    return data[:-pad_len]
-
-def aes_gcm_encrypt(plaintext):
-    cipher = AES.new(GCM_KEY, AES.MODE_GCM, nonce=GCM_IV)
-    ciphertext, tag = cipher.encrypt_and_digest(plaintext)
-    return ciphertext, tag
-
-def aes_gcm_decrypt(ciphertext, tag):
-    cipher = AES.new(GCM_KEY, AES.MODE_GCM, nonce=GCM_IV)
-    plaintext = cipher.decrypt_and_verify(ciphertext, tag)
-    return plaintext
-
-def combo_encrypt(username, message):
-    # Encrypt username separately for info (not shown in chat)
-    enc_username = aes_gcm_encrypt(username.encode())[0].hex()
-    data = f"{enc_username}|{message}"
-    gcm_ciphertext, tag = aes_gcm_encrypt(data.encode())
-    ige_input = pad(gcm_ciphertext + tag)
-    ige_ciphertext = ige256_encrypt(ige_input, IGE_KEY, IGE_IV)
-    return ige_ciphertext.hex()
-
-def combo_decrypt(hex_input):
-    ige_ciphertext = bytes.fromhex(hex_input)
-    ige_plain = ige256_decrypt(ige_ciphertext, IGE_KEY, IGE_IV)
-    gcm_output = unpad(ige_plain)
-    gcm_ciphertext, tag = gcm_output[:-16], gcm_output[-16:]
-    plain = aes_gcm_decrypt(gcm_ciphertext, tag)
-    s = plain.decode(errors='replace')
-    parts = s.split("|", 1)
-    if len(parts) == 2:
-        enc_username, msg = parts
-        try:
-            username = aes_gcm_decrypt(bytes.fromhex(enc_username), b"\x00"*16)
-            username = username.decode(errors='replace')
-        except Exception:
-            username = "<error>"
-        return username, msg
-    else:
-        return "<unknown>", s
+from PySide6.QtCore import (
+    Qt, Slot, QObject, QTimer, QThread, QMetaObject, QAbstractListModel, QModelIndex, QRect, QSize
+)
+from PySide6.QtGui import QColor
 
-def format_message(timestamp, username, message, self_user, user_colors):
+from chat_core import (
+    DISCORD_TOKEN, GCM_KEY, HISTORY_PAGE, SEARCH_PAGE, SHUTDOWN_TIMEOUT_MS,
+    Channel, ChatClient, Event, MessageStore, load_channels, save_channels, split_message, parse_query,
+)
+
+# --- Chat log ---
+CHAT_SCROLLBACK = 5000  # messages kept in the view; older ones are evicted
+
+def message_color(username, self_user, user_colors):
     # Chat color logic: self - grey, others - light purple, system - orange
     if username == "[SYSTEM]":
-        color = "#FFA500"
+        return "#FFA500"
     elif username == self_user:
-        color = "#888888"
-    else:
-        color = user_colors.get(username, "#D6BAF6")
+        return "#888888"
+    return user_colors.get(username, "#D6BAF6")
+
+def format_message(timestamp, username, message, self_user, user_colors):
+    color = message_color(username, self_user, user_colors)
     html = f'<div style="color:{color}">[{timestamp}] &#123;<b>{username}</b>&#125; : <b>{message}</b></div>'
     return html
 
-# ---- DISCORD LISTENER THREAD ----
-class DiscordListener(QThread):
-    message_received = Signal(str, str, str)  # timestamp, username, message
-    error_signal = Signal(str)
-    reconnecting_signal = Signal()
+# ---- CHAT LOG MODEL/VIEW ----
+ChatRecord = namedtuple("ChatRecord", "timestamp username message color key", defaults=(None,))
 
-    def __init__(self, token, channel_id, self_user):
+class ChatLogModel(QAbstractListModel):
+    """Bounded list of ChatRecords; the oldest are evicted past `limit`."""
+    def __init__(self, limit=CHAT_SCROLLBACK):
+        super().__init__()
+        self.limit = limit
+        self.records = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.records)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        rec = self.records[index.row()]
+        if role == Qt.DisplayRole:
+            return f"[{rec.timestamp}] {{{rec.username}}} : {rec.message}"
+        if role == Qt.UserRole:
+            return rec
+        return None
+
+    def extend(self, records):
+        # One insert (and at most one eviction) per batch, however many records arrive
+        if not records:
+            return
+        records = records[-self.limit:]
+        overflow = len(self.records) + len(records) - self.limit
+        if overflow > 0:
+            self.beginRemoveRows(QModelIndex(), 0, overflow - 1)
+            del self.records[:overflow]
+            self.endRemoveRows()
+        first = len(self.records)
+        self.beginInsertRows(QModelIndex(), first, first + len(records) - 1)
+        self.records.extend(records)
+        self.endInsertRows()
+
+    def prepend(self, records):
+        """
+        Older history paged in at the top. Past `limit` the newest rows are
+        dropped instead, so what the user just scrolled back to stays;
+        returns how many were dropped.
+        """
+        if not records:
+            return 0
+        records = records[-self.limit:]
+        self.beginInsertRows(QModelIndex(), 0, len(records) - 1)
+        self.records[:0] = records
+        self.endInsertRows()
+        overflow = len(self.records) - self.limit
+        if overflow > 0:
+            self.beginRemoveRows(QModelIndex(), self.limit, len(self.records) - 1)
+            del self.records[self.limit:]
+            self.endRemoveRows()
+        return max(0, overflow)
+
+    def oldest_key(self):
+        for rec in self.records:
+            if rec.key is not None:
+                return rec.key
+        return None
+
+    def newest_key(self):
+        for rec in reversed(self.records):
+            if rec.key is not None:
+                return rec.key
+        return None
+
+    def row_of(self, key):
+        for row, rec in enumerate(self.records):
+            if rec.key == key:
+                return row
+        return None
+
+    def clear(self):
+        self.beginResetModel()
+        self.records = []
+        self.endResetModel()
+
+
+class ChatDelegate(QStyledItemDelegate):
+    """Paints one record as wrapped, colored text; only visible rows are painted."""
+    PADDING = 2
+    HIGHLIGHT = QColor("#3A3550")  # the search result jumped to
+
+    def paint(self, painter, option, index):
+        rec = index.data(Qt.UserRole)
+        painter.save()
+        if rec.key is not None and rec.key == getattr(self.parent(), "highlight_key", None):
+            painter.fillRect(option.rect, self.HIGHLIGHT)
+        painter.setPen(QColor(rec.color))
+        rect = option.rect.adjusted(self.PADDING, self.PADDING, -self.PADDING, -self.PADDING)
+        painter.drawText(rect, Qt.TextWordWrap, index.data(Qt.DisplayRole))
+        painter.restore()
+
+    def sizeHint(self, option, index):
+        width = max(option.rect.width(), 100) - 2 * self.PADDING
+        rect = option.fontMetrics.boundingRect(QRect(0, 0, width, 100000), Qt.TextWordWrap, index.data(Qt.DisplayRole))
+        return QSize(width, rect.height() + 2 * self.PADDING)
+
+class ChatView(QListView):
+    """
+    One channel's log: its own model, incoming queue and paging state.
+    Bursts of incoming records are flushed into the model once per frame.
+    After a jump to a search result, or once paging in older history has
+    pushed the newest rows out of the scrollback, the view is not `live`:
+    new messages only reach the store until it has been scrolled (or
+    reset) back to the latest.
+    """
+    def __init__(self, channel):
         super().__init__()
-        self.token = token
-        self.channel_id = channel_id
-        self.self_user = self_user
-        self.client = None
-        self.running = True
+        self.channel = channel
+        self.chat_model = ChatLogModel(CHAT_SCROLLBACK)
+        self.setModel(self.chat_model)
+        self.setItemDelegate(ChatDelegate(self))
+        self.setWordWrap(True)
+        self.setResizeMode(QListView.Adjust)
+        self.setLayoutMode(QListView.Batched)
+        self.setBatchSize(200)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setSelectionMode(QAbstractItemView.NoSelection)
+        self.loading_older = False
+        self.discord_before = None  # oldest Discord id paged in, which may be below the oldest row
+        self.live = True
+        self.highlight_key = None
+        self.incoming = []
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(16)
+        self.flush_timer.timeout.connect(self.flush_incoming)
+
+    def queue(self, record):
+        self.incoming.append(record)
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def flush_incoming(self):
+        records, self.incoming = self.incoming, []
+        bar = self.verticalScrollBar()
+        at_bottom = bar.value() >= bar.maximum() - 4
+        self.chat_model.extend(records)
+        if at_bottom:
+            self.scrollToBottom()
+
+    def prepend_records(self, records):
+        if not records:
+            return
+        if self.chat_model.prepend(records):
+            # The live end was cut off: stop appending until scrolled back down (see load_newer)
+            self.incoming = []
+            self.live = False
+        self.scrollTo(self.chat_model.index(len(records)), QAbstractItemView.PositionAtTop)
+
+    def show_context(self, records, key, live):
+        self.incoming = []
+        self.discord_before = None
+        self.live = live
+        self.highlight_key = key
+        self.chat_model.clear()
+        self.chat_model.extend(records)
+        row = self.chat_model.row_of(key)
+        if row is not None:
+            self.scrollTo(self.chat_model.index(row), QAbstractItemView.PositionAtCenter)
+
+    def clear(self):
+        self.incoming = []
+        self.discord_before = None
+        self.live = True
+        self.highlight_key = None
+        self.chat_model.clear()
+
+class GuiQueue(QObject):
+    """
+    Runs callables on the thread this object lives in (the GUI thread);
+    put() may be called from any thread. Used instead of emitting Python
+    signals from worker threads: with some PySide6 builds, Signal.emit()
+    aborts the process when another Python thread runs at the same time,
+    while a queued invokeMethod() does not.
+    """
+    def __init__(self):
+        super().__init__()
+        self.pending = deque()  # (callable, args)
+
+    def put(self, func, *args):
+        self.pending.append((func, args))
+        QMetaObject.invokeMethod(self, "flush", Qt.QueuedConnection)
+
+    @Slot()
+    def flush(self):
+        while self.pending:
+            func, args = self.pending.popleft()
+            func(*args)
+
+class DiscordListener(QThread):
+    """
+    Runs a chat_core.ChatClient on this thread's own asyncio loop and
+    re-fires its events on the GUI thread, through Event attributes of the
+    same names (see GuiQueue for why they are not Qt signals).
+    """
+    def __init__(self, token, channels, self_user, store=None, core=None):
+        super().__init__()
+        self.core = core or ChatClient(token, channels, self_user, store)
+        self.gui = GuiQueue()
+        for name in ("message_received", "history_loaded", "file_received",
+                     "error_signal", "reconnecting_signal", "send_status"):
+            event = Event()
+            setattr(self, name, event)
+            getattr(self.core, name).connect(lambda *args, event=event: self.gui.put(event.emit, *args))
+        self.subscribe = self.core.subscribe
+        self.unsubscribe = self.core.unsubscribe
+        self.fetch_older = self.core.fetch_older
+        self.queue_message = self.core.queue_message
+        self.queue_file = self.core.queue_file
 
     def run(self):
-        intents = discord.Intents.default()
-        intents.message_content = True
-
-        class DiscordBot(discord.Client):
-            async def on_ready(botself):
-                try:
-                    channel = botself.get_channel(self.channel_id)
-                    if channel:
-                        messages = [msg async for msg in channel.history(limit=30, oldest_first=True)]
-                        for msg in messages:
-                            if msg.author.bot:
-                                try:
-                                    username, payload = combo_decrypt(msg.content.strip())
-                                    ts = msg.created_at.strftime("%Y-%m-%d %H:%M:%S")
-                                    self.message_received.emit(ts, username, payload)
-                                except Exception:
-                                    continue
-                except Exception as e:
-                    self.error_signal.emit(f"Error fetching history: {e}")
-
-            async def on_message(botself, message):
-                if message.author.bot:
-                    try:
-                        username, payload = combo_decrypt(message.content.strip())
-                        ts = message.created_at.strftime("%Y-%m-%d %H:%M:%S")
-                        self.message_received.emit(ts, username, payload)
-                    except Exception as e:
-                        self.error_signal.emit(f"Error decrypting message: {e}")
-
-        while self.running:
-            try:
-                self.client = DiscordBot(intents=intents)
-                self.client.channel_id = self.channel_id
-                self.client.run(self.token)
-            except Exception as e:
-                self.error_signal.emit(f"Discord error: {e}")
-                self.reconnecting_signal.emit()
-                time.sleep(5)
+        self.core.run()
 
     def stop(self):
-        self.running = False
-        if self.client:
-            try:
-                self.client.close()
-            except Exception:
-                pass
+        """Ask the loop to close the client; returns at once (wait() to join)."""
+        self.core.stop()
 
 # ---- MAIN GUI ----
 class ChatWindow(QMainWindow):
-    def __init__(self):
+    # The arguments default to the saved username, the history store,
+    # the configured channels and a new ChatClient; chat_bench.py passes its own.
+    def __init__(self, username=None, store=None, channels=None, core=None):
         super().__init__()
         self.setWindowTitle("VORTEX CHAT")
         self.resize(750, 600)
-        self.username = self.get_username()
+        self.username = username or self.get_username()
         self.user_colors = {}
         self.init_ui()
-        self.discord_thread = DiscordListener(DISCORD_TOKEN, DISCORD_CHANNEL_ID, self.username)
+        self.store = store or MessageStore()
+        self.channels = load_channels() if channels is None else channels
+        self.views = {}  # channel id -> ChatView
+        self.send_channels = {}  # send id -> channel id, for status messages
+        self.search_state = None  # (channel id, SearchQuery, next page key or None)
+        self.search_pending = None  # the search_state whose next page is being fetched
+        self.search_wanted = 0  # results still to fetch for the current page
+        self.gui = GuiQueue()
+        # Rows stored before search existed are indexed in the background
+        threading.Thread(target=self.store.index_backlog, daemon=True).start()
+        self.discord_thread = DiscordListener(DISCORD_TOKEN, self.channels, self.username, self.store, core)
         self.discord_thread.message_received.connect(self.handle_new_message)
+        self.discord_thread.history_loaded.connect(self.handle_history)
+        self.discord_thread.file_received.connect(self.handle_file_received)
         self.discord_thread.error_signal.connect(self.handle_error)
         self.discord_thread.reconnecting_signal.connect(self.handle_reconnect)
+        self.discord_thread.send_status.connect(self.handle_send_status)
+        for channel in self.channels.values():
+            self.add_view(channel)
+        if self.channels:
+            self.tabs.setCurrentIndex(1)
         self.discord_thread.start()
-        self.show_system_msg("Welcome! Type your message below. Type 'x' to return to lobby.")
+        if self.channels:
+            self.show_system_msg("Welcome! Type your message below. Type 'x' to return to lobby.")
+        else:
+            self.show_system_msg("No channels configured. Use 'Join Channel' to add one.")
         self.last_sent = None
 
     def closeEvent(self, event):
         self.discord_thread.stop()
+        self.discord_thread.wait(SHUTDOWN_TIMEOUT_MS)
+        self.store.close()
         event.accept()
 
     def get_username(self):
@@ -196,9 +320,36 @@ class ChatWindow(QMainWindow):
         central = QWidget()
         self.setCentralWidget(central)
         layout = QVBoxLayout(central)
-        self.chat_display = QTextEdit()
-        self.chat_display.setReadOnly(True)
-        layout.addWidget(self.chat_display)
+        # One tab per channel; system messages without a channel go to the current tab
+        self.tabs = QTabWidget()
+        self.tabs.setTabsClosable(True)
+        self.tabs.tabCloseRequested.connect(self.leave_channel)
+        self.lobby = ChatView(None)
+        self.tabs.addTab(self.lobby, "Lobby")
+        close_btn = self.tabs.tabBar().tabButton(0, QTabBar.RightSide)
+        if close_btn:
+            close_btn.hide()
+        layout.addWidget(self.tabs)
+        s = QHBoxLayout()
+        self.search_line = QLineEdit()
+        self.search_line.setPlaceholderText("Search this channel: words, from:name, since:2024-01-01, until:2024-02-01")
+        self.search_line.returnPressed.connect(self.run_search)
+        s.addWidget(self.search_line)
+        self.latest_btn = QPushButton("Latest")
+        self.latest_btn.clicked.connect(self.show_latest)
+        s.addWidget(self.latest_btn)
+        layout.addLayout(s)
+        # Results are paged in from the index as the list is scrolled; click one to jump to it
+        self.results = QListView()
+        self.results.setModel(ChatLogModel(CHAT_SCROLLBACK))
+        self.results.setItemDelegate(ChatDelegate(self.results))
+        self.results.setWordWrap(True)
+        self.results.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.results.setMaximumHeight(200)
+        self.results.clicked.connect(self.open_result)
+        self.results.verticalScrollBar().valueChanged.connect(self.maybe_more_results)
+        self.results.hide()
+        layout.addWidget(self.results)
         h = QHBoxLayout()
         self.input_line = QLineEdit()
         self.input_line.setPlaceholderText("Enter your message (or 'x' to exit to lobby)...")
@@ -207,6 +358,12 @@ class ChatWindow(QMainWindow):
         self.send_btn = QPushButton("Send")
         self.send_btn.clicked.connect(self.send_message)
         h.addWidget(self.send_btn)
+        self.file_btn = QPushButton("Send File")
+        self.file_btn.clicked.connect(self.send_file)
+        h.addWidget(self.file_btn)
+        self.join_btn = QPushButton("Join Channel")
+        self.join_btn.clicked.connect(self.join_channel)
+        h.addWidget(self.join_btn)
         self.set_btn = QPushButton("Set Username")
         self.set_btn.clicked.connect(self.set_username)
         h.addWidget(self.set_btn)
@@ -215,19 +372,196 @@ class ChatWindow(QMainWindow):
         self.clear_btn.clicked.connect(self.clear_messages)
         h.addWidget(self.clear_btn)
 
-    def show_system_msg(self, msg):
+    def add_view(self, channel):
+        view = ChatView(channel)
+        view.verticalScrollBar().valueChanged.connect(lambda value, v=view: self.maybe_load_older(v, value))
+        view.verticalScrollBar().valueChanged.connect(lambda value, v=view: self.maybe_load_newer(v, value))
+        self.views[channel.channel_id] = view
+        self.tabs.addTab(view, channel.name)
+        self.load_stored_history(view)
+        return view
+
+    def current_view(self):
+        return self.tabs.currentWidget()
+
+    def current_channel(self):
+        return self.current_view().channel
+
+    def join_channel(self):
+        text, ok = QInputDialog.getText(self, "Join Channel", "Channel ID:")
+        if not ok or not text.strip().isdigit():
+            return
+        cid = int(text.strip())
+        if cid in self.views:
+            self.tabs.setCurrentWidget(self.views[cid])
+            return
+        name, ok = QInputDialog.getText(self, "Join Channel", "Room name:", text=str(cid))
+        if not ok:
+            return
+        channel = Channel(cid, name.strip() or str(cid), GCM_KEY)
+        self.channels[cid] = channel
+        save_channels(self.channels)
+        self.tabs.setCurrentWidget(self.add_view(channel))
+        self.discord_thread.subscribe(channel)
+
+    def leave_channel(self, index):
+        view = self.tabs.widget(index)
+        if view is self.lobby:
+            return
+        cid = view.channel.channel_id
+        self.discord_thread.unsubscribe(cid)
+        self.tabs.removeTab(index)
+        del self.views[cid]
+        self.channels.pop(cid, None)
+        save_channels(self.channels)
+        view.deleteLater()
+
+    def show_system_msg(self, msg, channel_id=None):
         ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        html = format_message(ts, "[SYSTEM]", msg, self.username, self.user_colors)
-        self.chat_display.append(html)
+        self.queue_record(self.views.get(channel_id) or self.current_view(), ts, "[SYSTEM]", msg)
+
+    def handle_new_message(self, channel_id, timestamp, username, message):
+        view = self.views.get(channel_id)
+        if view is not None and view.live:
+            self.handle_new_user(username)
+            self.queue_record(view, timestamp, username, message)
 
-    def handle_new_message(self, timestamp, username, message):
+    def handle_new_user(self, username):
         if username not in self.user_colors and username != self.username and username != "[SYSTEM]":
             color_list = ["#D6BAF6", "#B5D6F6", "#F6BAD9", "#F6F0BA"]
             idx = len(self.user_colors) % len(color_list)
             self.user_colors[username] = color_list[idx]
-        html = format_message(timestamp, username, message, self.username, self.user_colors)
-        self.chat_display.append(html)
-        self.chat_display.moveCursor(self.chat_display.textCursor().End)
+
+    def queue_record(self, view, timestamp, username, message, key=None):
+        color = message_color(username, self.username, self.user_colors)
+        view.queue(ChatRecord(timestamp, username, message, color, key))
+
+    def make_records(self, rows):
+        records = []
+        for key, timestamp, username, message in rows:
+            self.handle_new_user(username)
+            color = message_color(username, self.username, self.user_colors)
+            records.append(ChatRecord(timestamp, username, message, color, key))
+        return records
+
+    def load_stored_history(self, view):
+        rows = self.store.latest(view.channel.channel_id, HISTORY_PAGE)
+        view.chat_model.extend(self.make_records(rows))
+        view.scrollToBottom()
+
+    def handle_history(self, channel_id, rows, older, reached=None):
+        view = self.views.get(channel_id)
+        if view is None:
+            return
+        if not older:
+            if not view.live:
+                return
+            for key, timestamp, username, message in rows:
+                self.handle_new_user(username)
+                self.queue_record(view, timestamp, username, message, key)
+            return
+        view.loading_older = False
+        if reached is not None:
+            view.discord_before = min(reached, view.discord_before or reached)
+        view.prepend_records(self.make_records(rows))
+
+    def maybe_load_older(self, view, value):
+        if value == 0 and not view.loading_older and view.chat_model.records:
+            self.load_older(view)
+
+    def load_older(self, view):
+        # Local store first; go to Discord only once the store runs out
+        key = view.chat_model.oldest_key()
+        if key is None:
+            return
+        rows = self.store.page(view.channel.channel_id, key, HISTORY_PAGE)
+        if rows:
+            view.prepend_records(self.make_records(rows))
+            return
+        before = min(key[0], view.discord_before or key[0])
+        if self.discord_thread.fetch_older(view.channel.channel_id, before):
+            view.loading_older = True
+
+    def maybe_load_newer(self, view, value):
+        if not view.live and value == view.verticalScrollBar().maximum():
+            self.load_newer(view)
+
+    def load_newer(self, view):
+        # Back down towards the live end after a jump; the store has everything received meanwhile
+        key = view.chat_model.newest_key()
+        rows = self.store.page_after(view.channel.channel_id, key, HISTORY_PAGE) if key else []
+        view.chat_model.extend(self.make_records(rows))
+        if len(rows) < HISTORY_PAGE:
+            view.live = True
+
+    def show_latest(self):
+        view = self.current_view()
+        if view is self.lobby:
+            return
+        view.clear()
+        self.load_stored_history(view)
+
+    def run_search(self):
+        text = self.search_line.text().strip()
+        channel = self.current_channel()
+        self.results.model().clear()
+        self.search_pending = None
+        if not text or channel is None:
+            self.search_state = None
+            self.results.hide()
+            return
+        try:
+            query = parse_query(text)
+        except ValueError as e:
+            self.show_system_msg(f"Bad search: {e}")
+            return
+        self.search_state = (channel.channel_id, query, None)
+        self.results.show()
+        self.more_results()
+
+    def more_results(self, wanted=SEARCH_PAGE):
+        # A page may decrypt and check many candidate rows; fetch it off the GUI thread
+        state = self.search_pending = self.search_state
+        self.search_wanted = wanted
+        threading.Thread(target=self.fetch_results, args=(state, wanted), daemon=True).start()
+
+    def fetch_results(self, state, wanted):
+        cid, query, before = state
+        rows, before = self.store.search(cid, query, before, wanted)
+        self.gui.put(self.show_results, state, rows, before)
+
+    def show_results(self, state, rows, before):
+        if state is not self.search_pending:
+            return  # a newer search replaced this one
+        self.search_pending = None
+        cid, query, _ = state
+        self.search_state = (cid, query, before)
+        self.results.model().extend(self.make_records(rows))
+        # store.search returns short pages when it stops at its scan limit; keep going until this one is full
+        if before is not None and len(rows) < self.search_wanted:
+            self.more_results(self.search_wanted - len(rows))
+        elif before is None and not self.results.model().records:
+            self.show_system_msg(f"No messages match '{self.search_line.text().strip()}'.")
+
+    def maybe_more_results(self, value):
+        if (self.search_state and self.search_state[2] and self.search_pending is None
+                and value == self.results.verticalScrollBar().maximum()):
+            self.more_results()
+
+    def open_result(self, index):
+        rec = index.data(Qt.UserRole)
+        view = self.views.get(self.search_state[0]) if self.search_state else None
+        if view is not None and rec.key is not None:
+            self.jump_to(view, rec.key)
+
+    def jump_to(self, view, key):
+        # Half a page of stored context on each side; the target row is included in the older half
+        half = HISTORY_PAGE // 2
+        cid = view.channel.channel_id
+        older = self.store.page(cid, (key[0], key[1] + 1), half)
+        newer = self.store.page_after(cid, key, half)
+        self.tabs.setCurrentWidget(view)
+        view.show_context(self.make_records(older + newer), key, live=len(newer) < half)
 
     def handle_error(self, msg):
         self.show_system_msg(f"Error: {msg}")
@@ -235,6 +569,20 @@ class ChatWindow(QMainWindow):
     def handle_reconnect(self):
         self.show_system_msg("Reconnecting to 🛜...")
 
+    def handle_file_received(self, channel_id, username, path):
+        self.show_system_msg(f"File from {username} saved to {path}", channel_id)
+
+    def handle_send_status(self, send_id, status, detail):
+        channel_id = self.send_channels.get(send_id)
+        if status in ("sent", "failed"):
+            self.send_channels.pop(send_id, None)
+        if status == "sent":
+            self.show_system_msg("Message Sent!", channel_id)
+        elif status == "retrying":
+            self.show_system_msg(f"Retrying message #{send_id}... ({detail})", channel_id)
+        elif status == "failed":
+            self.show_system_msg(f"Error sending message! ({detail})", channel_id)
+
     def set_username(self):
         username, ok = QInputDialog.getText(self, "Set Username", "Enter new username:")
         if ok and username.strip():
@@ -246,9 +594,15 @@ class ChatWindow(QMainWindow):
             self.send_discord_message(f"[SYSTEM] {self.username} changed their username.")
 
     def clear_messages(self):
+        view = self.current_view()
+        if view is self.lobby:
+            view.clear()
+            return
         try:
             self.send_discord_message("[SYSTEM] All previous messages destroyed by user!")
-            self.chat_display.clear()
+            view.clear()
+            self.results.model().clear()
+            self.store.clear(view.channel.channel_id)
         except Exception:
             self.show_system_msg("Error destroying messages!")
 
@@ -256,6 +610,10 @@ class ChatWindow(QMainWindow):
         msg = self.input_line.text().strip()
         if not msg:
             return
+        if self.current_channel() is None:
+            self.show_system_msg("Pick a channel tab (or join one) to send messages.")
+            self.input_line.clear()
+            return
         if msg == "x":
             self.show_system_msg("Returned to lobby (close app to exit).")
             self.input_line.clear()
@@ -264,40 +622,31 @@ class ChatWindow(QMainWindow):
         payload = f"[{timestamp}] {{{self.username}}} : {msg}"
         try:
             self.send_discord_message(payload)
-            self.show_system_msg("Message Sent!")
         except Exception as e:
             self.show_system_msg(f"Error sending message! ({e})")
         self.input_line.clear()
 
     def send_discord_message(self, message):
-        enc_username = aes_gcm_encrypt(self.username.encode())[0].hex()
-        payload = f"{enc_username}|{message}"
-        gcm_ciphertext, tag = aes_gcm_encrypt(payload.encode())
-        ige_input = pad(gcm_ciphertext + tag)
-        ige_ciphertext = ige256_encrypt(ige_input, IGE_KEY, IGE_IV)
-        payload_hex = ige_ciphertext.hex()
-        def sender():
-            try:
-                import asyncio
-                nest_asyncio.apply()
-                intents = discord.Intents.default()
-                intents.message_content = True
-                class TinyClient(discord.Client):
-                    async def on_ready(self):
-                        try:
-                            channel = self.get_channel(DISCORD_CHANNEL_ID)
-                            if channel:
-                                await channel.send(payload_hex)
-                        except Exception as e:
-                            pass
-                        await self.close()
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                client = TinyClient(intents=intents)
-                client.run(DISCORD_TOKEN)
-            except Exception as e:
-                self.show_system_msg(f"Error sending message! {e}")
-        threading.Thread(target=sender).start()
+        # Goes to the current tab's channel through the shared connection; delivery is reported via send_status.
+        # Long messages are split into encrypted chunks that are reassembled on receive
+        channel = self.current_channel()
+        if channel is None:
+            return None
+        send_id = self.discord_thread.queue_message(
+            channel.channel_id, split_message(self.username, message, key=channel.key))
+        self.send_channels[send_id] = channel.channel_id
+        return send_id
+
+    def send_file(self):
+        channel = self.current_channel()
+        if channel is None:
+            self.show_system_msg("Pick a channel tab (or join one) to send files.")
+            return
+        path, _ = QFileDialog.getOpenFileName(self, "Send File")
+        if not path:
+            return
+        self.show_system_msg(f"Sending {os.path.basename(path)}...")
+        threading.Thread(target=self.discord_thread.queue_file, args=(channel, self.username, path), daemon=True).start()
 
 # Aplikace start
 if __name__ == "__main__":
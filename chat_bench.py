@@ -0,0 +1,442 @@
+"""
+Chat pipeline benchmark against a local Discord stand-in. No token,
+network or display needed:
+
+    python chat_bench.py                          # crypto + end-to-end, default sizes
+    python chat_bench.py --rates 50 200 0 --sizes 100 4000 --duration 5
+    python chat_bench.py --gui --json             # through ChatWindow (offscreen Qt)
+
+First combo_encrypt, combo_decrypt and format_message are timed on their
+own for each message size. Then, for each size and rate (0 = as fast as
+the pipeline takes them), messages are queued on a real ChatClient whose
+connection is a FakeGateway: the send worker, batching, delivery, echo
+back through on_message, decryption, the local store and, with --gui,
+ChatWindow.handle_new_message on the GUI thread. Each run reports
+messages per second, p50/p99 end-to-end latency (queued to handled) and
+resident memory growth over the run.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from chat_core import (
+    GCM_KEY, Channel, ChatClient, MessageStore, combo_encrypt, combo_decrypt, split_message,
+)
+
+DEFAULT_SIZES = (100, 1000, 4000)
+DEFAULT_RATES = (100, 0)
+BENCH_CHANNEL = 1 << 60
+BENCH_USER = "bench"
+
+# ----------- Local Discord stand-in -------------
+class FakeObject:
+    def __init__(self, id):
+        self.id = id
+
+class FakeMessage:
+    def __init__(self, id, channel, content):
+        self.id = id
+        self.channel = channel
+        self.content = content
+        self.author = FakeObject(0)
+        self.author.bot = True
+        self.attachments = []
+        self.created_at = datetime.now(timezone.utc)
+
+class FakeChannel:
+    """A text channel: keeps every message and echoes each send to all connected clients."""
+    def __init__(self, gateway, id):
+        self.gateway = gateway
+        self.id = id
+        self.messages = []
+
+    async def send(self, content, file=None):
+        message = FakeMessage(next(self.gateway.ids), self, content)
+        self.messages.append(message)
+        self.gateway.dispatch(message)
+        return message
+
+    async def history(self, limit=100, after=None, before=None, oldest_first=None):
+        messages = [m for m in self.messages
+                    if (after is None or m.id > after.id) and (before is None or m.id < before.id)]
+        if not oldest_first:
+            messages.reverse()
+        for message in messages[:limit]:
+            yield message
+
+class FakeGateway:
+    """
+    In-process stand-in for the part of Discord that ChatClient uses: login,
+    connect, ready, channel lookup, send, history and message events, with
+    an optional one-way delay in seconds.
+    """
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.ids = itertools.count(1 << 40)
+        self.channels = {}
+        self.clients = []
+
+    def channel(self, channel_id):
+        if channel_id not in self.channels:
+            self.channels[channel_id] = FakeChannel(self, channel_id)
+        return self.channels[channel_id]
+
+    def dispatch(self, message):
+        for client in self.clients:
+            if client.loop is not None and not client.is_closed():
+                client.loop.call_soon_threadsafe(client.deliver_event, message)
+
+    def client_class(self):
+        gateway = self
+
+        class FakeClient:
+            def __init__(self, *, intents=None):
+                self.loop = None
+                self.ready = None
+                self.closed = None
+
+            async def __aenter__(self):
+                self.loop = asyncio.get_running_loop()
+                self.ready = asyncio.Event()
+                self.closed = asyncio.Event()
+                return self
+
+            async def __aexit__(self, *exc):
+                await self.close()
+
+            async def setup_hook(self):
+                pass
+
+            async def login(self, token):
+                pass
+
+            async def connect(self, reconnect=True):
+                await self.setup_hook()
+                gateway.clients.append(self)
+                self.ready.set()
+                asyncio.create_task(self.on_ready())
+                await self.closed.wait()
+
+            async def close(self):
+                if self in gateway.clients:
+                    gateway.clients.remove(self)
+                if self.closed is not None:
+                    self.closed.set()
+
+            def is_closed(self):
+                return self.closed is None or self.closed.is_set()
+
+            def is_ready(self):
+                return self.ready is not None and self.ready.is_set()
+
+            async def wait_until_ready(self):
+                await self.ready.wait()
+
+            def get_channel(self, channel_id):
+                return gateway.channel(channel_id)
+
+            async def fetch_channel(self, channel_id):
+                return gateway.channel(channel_id)
+
+            def deliver_event(self, message):
+                if gateway.delay:
+                    self.loop.call_later(gateway.delay, self.deliver_event_now, message)
+                else:
+                    self.deliver_event_now(message)
+
+            def deliver_event_now(self, message):
+                asyncio.ensure_future(self.on_message(message))
+
+        return FakeClient
+
+# ----------- Measurement helpers -------------
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # No procfs: peak RSS is the best we have (KiB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+def make_text(seq, size):
+    head = f"{seq:010d} "
+    return head + "x" * max(0, size - len(head))
+
+def time_op(op, n):
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        op()
+        samples.append(time.perf_counter() - start)
+    return dict(ops_s=n / sum(samples), p50_us=percentile(samples, 50) * 1e6, p99_us=percentile(samples, 99) * 1e6)
+
+def run_micro(size, n):
+    from chat import format_message
+    text = make_text(0, size)
+    payload = combo_encrypt(BENCH_USER, text)
+    return dict(
+        size=size,
+        encrypt=time_op(lambda: combo_encrypt(BENCH_USER, text), n),
+        decrypt=time_op(lambda: combo_decrypt(payload), n),
+        format=time_op(lambda: format_message("2026-01-01 00:00:00", "peer", text, BENCH_USER, {}), n),
+    )
+
+# ----------- End-to-end runs -------------
+class Run:
+    """Latency bookkeeping shared by the producer and whichever thread handles messages."""
+    def __init__(self):
+        self.total = 1 << 62  # set once the producer stops
+        self.sent_at = {}
+        self.latencies = []
+        self.handle_times = []
+        self.received = 0
+        self.first_sent = None
+        self.last_received = None
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.memory = []
+
+    def sent(self, seq):
+        with self.lock:
+            self.sent_at[seq] = time.perf_counter()
+            if self.first_sent is None:
+                self.first_sent = self.sent_at[seq]
+
+    def in_flight(self):
+        return len(self.sent_at)
+
+    def stop_sending(self):
+        with self.lock:
+            self.total = self.received + len(self.sent_at)
+            if self.received >= self.total:
+                self.done.set()
+
+    def received_text(self, message):
+        now = time.perf_counter()
+        seq = int(message[:10])
+        with self.lock:
+            sent = self.sent_at.pop(seq, None)
+            if sent is None:
+                return
+            self.latencies.append(now - sent)
+            self.received += 1
+            self.last_received = now
+            if self.received >= self.total:
+                self.done.set()
+
+def produce(client, run, size, rate, args):
+    """
+    Queue messages on the calling thread at `rate` per second. Rate 0 keeps
+    `args.window` messages in flight for `args.duration` seconds, so it
+    measures throughput rather than an ever-growing outbox.
+    """
+    n_warm = int(rate * args.warmup) if rate else 0
+    start = time.perf_counter()
+    for seq in itertools.count():
+        now = time.perf_counter()
+        if rate:
+            if seq >= n_warm + int(rate * args.duration):
+                break
+            if start + seq / rate > now:
+                time.sleep(start + seq / rate - now)
+        else:
+            if now - start > args.duration:
+                break
+            while run.in_flight() >= args.window and not run.done.is_set():
+                time.sleep(0.0005)
+        if seq >= n_warm:
+            run.sent(seq)
+        client.queue_message(BENCH_CHANNEL, split_message(BENCH_USER, make_text(seq, size)))
+    run.stop_sending()
+
+def sample_memory(run, interval=0.25):
+    start = time.perf_counter()
+    while not run.done.wait(interval):
+        run.memory.append((time.perf_counter() - start, rss_bytes()))
+    run.memory.append((time.perf_counter() - start, rss_bytes()))
+
+def bench_client(gateway, store, send_interval):
+    channels = {BENCH_CHANNEL: Channel(BENCH_CHANNEL, "bench", GCM_KEY)}
+    client = ChatClient("", channels, BENCH_USER, store, client_class=gateway.client_class())
+    # The stand-in has no rate limit; Discord's pacing would only measure SEND_INTERVAL
+    client.SEND_INTERVAL = send_interval
+    return client, channels
+
+def wait_connected(client, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while client.client is None or not client.client.is_ready():
+        if time.monotonic() > deadline:
+            raise RuntimeError("fake gateway did not come up")
+        time.sleep(0.01)
+
+def run_headless(size, rate, args, store):
+    gateway = FakeGateway(args.gateway_ms / 1000)
+    client, _ = bench_client(gateway, store, args.send_interval)
+    run = Run()
+    client.message_received.connect(lambda cid, ts, user, message: run.received_text(message))
+    thread = threading.Thread(target=client.run, name="chat-bench")
+    thread.start()
+    try:
+        wait_connected(client)
+        rss0 = rss_bytes()
+        sampler = threading.Thread(target=sample_memory, args=(run,), daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        produce(client, run, size, rate, args)
+        run.done.wait(args.drain)
+        run.done.set()
+        sampler.join()
+    finally:
+        client.stop()
+        thread.join()
+    return report(size, rate, run, start, rss0)
+
+def run_gui(size, rate, args, store):
+    from PySide6.QtCore import QTimer
+    from PySide6.QtWidgets import QApplication
+    from chat import ChatWindow
+
+    class BenchWindow(ChatWindow):
+        def handle_new_message(self, channel_id, timestamp, username, message):
+            start = time.perf_counter()
+            super().handle_new_message(channel_id, timestamp, username, message)
+            run.handle_times.append(time.perf_counter() - start)
+            run.received_text(message)
+
+    app = QApplication.instance() or QApplication([])
+    gateway = FakeGateway(args.gateway_ms / 1000)
+    client, channels = bench_client(gateway, store, args.send_interval)
+    run = Run()
+    window = BenchWindow(BENCH_USER, store, channels, client)
+    window.show()
+    result = {}
+
+    def drive():
+        try:
+            wait_connected(client)
+            result["rss0"] = rss_bytes()
+            sampler = threading.Thread(target=sample_memory, args=(run,), daemon=True)
+            sampler.start()
+            result["start"] = time.perf_counter()
+            produce(client, run, size, rate, args)
+            run.done.wait(args.drain)
+        finally:
+            run.done.set()
+            result["finished"] = True
+
+    def poll():
+        if result.get("finished"):
+            timer.stop()
+            window.close()
+            app.quit()
+
+    producer = threading.Thread(target=drive, name="chat-bench-producer", daemon=True)
+    timer = QTimer()
+    timer.timeout.connect(poll)
+    timer.start(50)
+    producer.start()
+    app.exec()
+    producer.join()
+    out = report(size, rate, run, result["start"], result["rss0"])
+    out["handle_p50_us"] = percentile(run.handle_times, 50) * 1e6
+    out["handle_p99_us"] = percentile(run.handle_times, 99) * 1e6
+    return out
+
+def report(size, rate, run, start, rss0):
+    # Throughput over the measured messages only, i.e. after the warm-up
+    elapsed = (run.last_received or time.perf_counter()) - (run.first_sent or start)
+    growth = (run.memory[-1][1] - rss0) if run.memory else 0
+    return dict(
+        size=size,
+        rate=rate,
+        received=run.received,
+        lost=len(run.sent_at),
+        msgs_s=run.received / elapsed if elapsed > 0 else 0.0,
+        p50_ms=percentile(run.latencies, 50) * 1000,
+        p99_ms=percentile(run.latencies, 99) * 1000,
+        max_ms=max(run.latencies, default=0.0) * 1000,
+        rss_start_mb=rss0 / 2 ** 20,
+        rss_growth_mb=growth / 2 ** 20,
+        rss_growth_kb_per_1k=growth / 1024 / max(run.received, 1) * 1000,
+        memory=[(round(t, 2), round(b / 2 ** 20, 2)) for t, b in run.memory],
+    )
+
+def print_micro(result):
+    parts = "  ".join(f"{name} {result[name]['ops_s']:9.0f}/s p50 {result[name]['p50_us']:7.1f} "
+                      f"p99 {result[name]['p99_us']:7.1f} us" for name in ("encrypt", "decrypt", "format"))
+    print(f"size {result['size']:>6}  {parts}")
+
+def print_run(result):
+    rate = f"{result['rate']:g}/s" if result["rate"] else "max"
+    line = (f"size {result['size']:>6}  rate {rate:>7}  {result['msgs_s']:8.1f} msgs/s  "
+            f"p50 {result['p50_ms']:7.2f}  p99 {result['p99_ms']:7.2f}  max {result['max_ms']:7.2f} ms  "
+            f"rss {result['rss_start_mb']:.1f} MB {result['rss_growth_mb']:+.1f} MB "
+            f"({result['rss_growth_kb_per_1k']:+.0f} KB/1k msgs)")
+    if result["lost"]:
+        line += f"  lost {result['lost']}"
+    if "handle_p50_us" in result:
+        line += f"  handle p50 {result['handle_p50_us']:.0f} p99 {result['handle_p99_us']:.0f} us"
+    print(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chat pipeline benchmark against a local Discord stand-in")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="message sizes in characters")
+    parser.add_argument("--rates", type=float, nargs="+", default=list(DEFAULT_RATES),
+                        help="messages per second; 0 sends back to back")
+    parser.add_argument("--duration", type=float, default=3.0, help="measured seconds per run")
+    parser.add_argument("--warmup", type=float, default=0.5, help="seconds of unmeasured messages first (rated runs)")
+    parser.add_argument("--window", type=int, default=50, help="messages in flight for rate 0")
+    parser.add_argument("--drain", type=float, default=10.0, help="seconds to wait for in-flight messages")
+    parser.add_argument("--gateway-ms", type=float, default=0.0, help="simulated one-way gateway delay")
+    parser.add_argument("--send-interval", type=float, default=0.0,
+                        help=f"seconds between sent batches (Discord pacing is {ChatClient.SEND_INTERVAL:g})")
+    parser.add_argument("--micro", type=int, default=2000, help="iterations per micro-benchmark (0 to skip)")
+    parser.add_argument("--gui", action="store_true", help="route messages through ChatWindow (offscreen Qt)")
+    parser.add_argument("--no-store", action="store_true", help="skip the SQLite history store")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.gui:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    results = dict(micro=[], runs=[])
+    if args.micro:
+        for size in args.sizes:
+            results["micro"].append(run_micro(size, args.micro))
+            if not args.json:
+                print_micro(results["micro"][-1])
+    with tempfile.TemporaryDirectory(prefix="chat-bench-") as tmp:
+        for size in args.sizes:
+            for rate in args.rates:
+                # One database per run: every FakeGateway numbers its messages from the same id,
+                # so a repeated size and rate would find its echoes already stored
+                path = os.path.join(tmp, f"{len(results['runs'])}-{size}-{rate}.db")
+                store = None if args.no_store else MessageStore(path, os.path.join(tmp, "store.key"))
+                try:
+                    result = (run_gui if args.gui else run_headless)(size, rate, args, store)
+                finally:
+                    if store is not None:
+                        store.close()
+                results["runs"].append(result)
+                if not args.json:
+                    print_run(result)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    return 1 if any(r["lost"] for r in results["runs"]) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
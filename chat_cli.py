@@ -0,0 +1,317 @@
+"""
+Headless chat client: the same channels, keys, local store and Discord
+connection as chat.py, without Qt. Commands and messages are read as lines
+from stdin, or from every client of a local Unix socket, and incoming
+messages are written back as text or JSON lines:
+
+    python chat_cli.py --user alice
+    python chat_cli.py --user bot --socket /tmp/chat3.sock --json
+    python chat_cli.py --startup-time          # print time to ready and exit
+
+Commands: /join ID [NAME], /leave ID, /channel ID, /channels, /file PATH,
+/search QUERY (words, from:name, since:DATE, until:DATE; newest first),
+/more (next page of results), /quit. Any other line is sent to the current
+channel (the first configured one to begin with). discord is imported in the
+background while the stored history is printed, so input is accepted before
+the gateway is up; messages typed meanwhile are queued and sent once
+connected.
+"""
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import sys
+import threading
+from datetime import datetime
+
+from chat_core import (
+    DISCORD_TOKEN, GCM_KEY, HISTORY_PAGE, SEARCH_PAGE,
+    Channel, ChatClient, MessageStore, load_channels, save_channels, split_message, parse_query,
+)
+
+class Session:
+    """One line-oriented peer (stdin/stdout or a socket connection) with its own current channel."""
+    def __init__(self, write, channel_id=None):
+        self.write = write
+        self.channel_id = channel_id
+        self.search = None  # (channel id, SearchQuery, next page key or None)
+        self.search_task = None
+
+class HeadlessChat:
+    def __init__(self, username, token=DISCORD_TOKEN, channels=None, store=None, as_json=False):
+        self.username = username
+        self.channels = load_channels() if channels is None else channels
+        self.store = store
+        self.as_json = as_json
+        self.sessions = set()
+        self.quit = None
+        self.loop = None
+        self.client = ChatClient(token, self.channels, username, store)
+        self.client.message_received.connect(self.on_message)
+        self.client.history_loaded.connect(self.on_history)
+        self.client.file_received.connect(self.on_file)
+        self.client.error_signal.connect(lambda msg: self.notice("error", msg))
+        self.client.reconnecting_signal.connect(lambda: self.notice("reconnecting", "Reconnecting..."))
+        self.client.send_status.connect(self.on_send_status)
+
+    # --- output; events arrive on the loop thread or on worker threads ---
+    def emit(self, record, session=None):
+        line = json.dumps(record, ensure_ascii=False) if self.as_json else self.format(record)
+        targets = [session] if session else list(self.sessions)
+        for target in targets:
+            self.loop.call_soon_threadsafe(target.write, line)
+
+    def format(self, record):
+        kind = record["type"]
+        if kind == "message":
+            name = self.channels[record["channel"]].name if record["channel"] in self.channels else record["channel"]
+            return f"#{name} {record['ts']} <{record['user']}> {record['text']}"
+        if kind == "result":
+            return f"? {record['ts']} <{record['user']}> {record['text']}"
+        if kind == "file":
+            return f"#{record['channel']} {record['user']} sent {record['path']}"
+        if kind == "send":
+            return f"* send {record['id']}: {record['status']}" + (f" ({record['detail']})" if record["detail"] else "")
+        return f"* {record['text']}"
+
+    def notice(self, kind, text, session=None):
+        self.emit({"type": kind, "text": text}, session)
+
+    def on_message(self, channel_id, ts, username, message):
+        self.emit({"type": "message", "channel": channel_id, "ts": ts, "user": username, "text": message})
+
+    def on_history(self, channel_id, rows, older, reached=None):
+        for key, ts, username, message in rows:
+            self.on_message(channel_id, ts, username, message)
+
+    def on_file(self, channel_id, username, path):
+        self.emit({"type": "file", "channel": channel_id, "user": username, "path": path})
+
+    def on_send_status(self, send_id, status, detail):
+        if status != "queued":
+            self.emit({"type": "send", "id": send_id, "status": status, "detail": detail})
+
+    # --- input ---
+    def default_channel(self):
+        return next(iter(self.channels), None)
+
+    def handle_line(self, session, line):
+        line = line.strip()
+        if not line:
+            return
+        if not line.startswith("/"):
+            self.send(session, line)
+            return
+        cmd, _, arg = line.partition(" ")
+        arg = arg.strip()
+        try:
+            if cmd == "/quit":
+                self.quit.set()
+            elif cmd == "/join":
+                cid, _, name = arg.partition(" ")
+                self.join(session, int(cid), name.strip())
+            elif cmd == "/leave":
+                self.leave(session, int(arg))
+            elif cmd == "/channel":
+                cid = int(arg)
+                if cid not in self.channels:
+                    raise ValueError(f"not subscribed to {cid}")
+                session.channel_id = cid
+                self.notice("info", f"Sending to #{self.channels[cid].name}", session)
+            elif cmd == "/channels":
+                for ch in self.channels.values():
+                    mark = ">" if ch.channel_id == session.channel_id else " "
+                    self.notice("info", f"{mark} {ch.channel_id} #{ch.name}", session)
+            elif cmd == "/file":
+                self.send_file(session, os.path.expanduser(arg))
+            elif cmd == "/search":
+                if self.store is None or session.channel_id not in self.channels:
+                    raise ValueError("search needs the local store and a current channel")
+                session.search = (session.channel_id, parse_query(arg), None)
+                session.search_task = asyncio.create_task(self.more_results(session))
+            elif cmd == "/more":
+                if session.search_task and not session.search_task.done():
+                    raise ValueError("still searching")
+                if not session.search or session.search[2] is None:
+                    raise ValueError("no more results")
+                session.search_task = asyncio.create_task(self.more_results(session))
+            else:
+                raise ValueError(f"unknown command {cmd}")
+        except ValueError as e:
+            self.notice("error", str(e), session)
+
+    def send(self, session, text):
+        channel = self.channels.get(session.channel_id)
+        if channel is None:
+            self.notice("error", "No channel; /join ID [NAME] first", session)
+            return
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        payload = f"[{timestamp}] {{{self.username}}} : {text}"
+        self.client.queue_message(channel.channel_id, split_message(self.username, payload, key=channel.key))
+
+    def send_file(self, session, path):
+        channel = self.channels.get(session.channel_id)
+        if channel is None or not os.path.isfile(path):
+            raise ValueError("need a current channel and an existing file")
+        threading.Thread(target=self.client.queue_file, args=(channel, self.username, path), daemon=True).start()
+
+    def join(self, session, cid, name=""):
+        if cid not in self.channels:
+            channel = Channel(cid, name or str(cid), GCM_KEY)
+            self.channels[cid] = channel
+            save_channels(self.channels)
+            self.print_stored(channel, session)
+            self.client.subscribe(channel)
+        session.channel_id = cid
+        self.notice("info", f"Joined #{self.channels[cid].name}", session)
+
+    def leave(self, session, cid):
+        channel = self.channels.pop(cid, None)
+        if channel is None:
+            raise ValueError(f"not subscribed to {cid}")
+        self.client.unsubscribe(cid)
+        save_channels(self.channels)
+        for other in self.sessions:
+            if other.channel_id == cid:
+                other.channel_id = self.default_channel()
+        self.notice("info", f"Left #{channel.name}", session)
+
+    async def more_results(self, session):
+        # Off the loop, which the gateway and the other sessions share. store.search
+        # may return short pages (it caps the rows it checks); continue until this one is full.
+        state = session.search
+        cid, query, before = state
+        found = 0
+        while True:
+            rows, before = await asyncio.to_thread(self.store.search, cid, query, before, SEARCH_PAGE - found)
+            if session.search is not state:
+                return  # a newer /search replaced this one
+            state = session.search = (cid, query, before)
+            for (msg_id, part), ts, username, message in rows:
+                self.emit({"type": "result", "channel": cid, "id": msg_id, "part": part,
+                           "ts": ts, "user": username, "text": message}, session)
+            found += len(rows)
+            if before is None or found >= SEARCH_PAGE:
+                break
+        self.notice("info", f"{found} results" + (", /more for older" if before else ""), session)
+
+    def print_stored(self, channel, session=None):
+        if self.store is None:
+            return
+        for key, ts, username, message in self.store.latest(channel.channel_id, HISTORY_PAGE):
+            self.emit({"type": "message", "channel": channel.channel_id, "ts": ts, "user": username, "text": message},
+                      session)
+
+    # --- transports ---
+    async def serve_stdio(self):
+        def write(line):
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+        session = Session(write, self.default_channel())
+        self.sessions.add(session)
+        lines = asyncio.Queue()
+
+        def pump():
+            # A thread on the raw fd rather than connect_read_pipe: stdin may be a
+            # file or /dev/null, which epoll refuses, and a daemon thread must not
+            # hold sys.stdin's buffer lock at interpreter exit.
+            put = lambda line: self.loop.call_soon_threadsafe(lines.put_nowait, line)
+            fd, pending = sys.stdin.fileno(), b""
+            try:
+                while data := os.read(fd, 65536):
+                    *complete, pending = (pending + data).split(b"\n")
+                    for line in complete:
+                        put(line + b"\n")
+                if pending:
+                    put(pending)
+                put(b"")
+            except (OSError, RuntimeError):
+                pass  # stdin closed, or the loop finished while we were blocked on input
+        threading.Thread(target=pump, name="stdin", daemon=True).start()
+        asyncio.create_task(self.read_lines(session, lines.get))
+        return lambda: None
+
+    async def serve_socket(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+
+        async def on_connect(reader, writer):
+            session = Session(lambda line: writer.write(line.encode() + b"\n"), self.default_channel())
+            self.sessions.add(session)
+            try:
+                await self.read_lines(session, reader.readline, quit_at_eof=False)
+            finally:
+                self.sessions.discard(session)
+                writer.close()
+
+        server = await asyncio.start_unix_server(on_connect, path)
+        os.chmod(path, 0o600)
+        return server.close
+
+    async def read_lines(self, session, readline, quit_at_eof=True):
+        while not self.quit.is_set():
+            line = await readline()
+            if not line:
+                break
+            self.handle_line(session, line.decode(errors="replace"))
+        if quit_at_eof:
+            self.quit.set()
+
+    async def run(self, socket_path=None, startup_only=False):
+        self.loop = asyncio.get_running_loop()
+        self.quit = asyncio.Event()
+        close = await self.serve_socket(socket_path) if socket_path else await self.serve_stdio()
+        ready_ms = (time.perf_counter() - STARTED) * 1000
+        print(f"ready in {ready_ms:.0f} ms", file=sys.stderr)
+        if startup_only:
+            close()
+            return ready_ms
+        for channel in self.channels.values():
+            self.print_stored(channel)
+        # The import is the bulk of startup; keep it off the loop so input is read meanwhile
+        await asyncio.to_thread(importlib.import_module, "discord")
+        if not self.quit.is_set():
+            connection = asyncio.create_task(self.client.main())
+            await asyncio.wait([connection, asyncio.create_task(self.quit.wait())], return_when=asyncio.FIRST_COMPLETED)
+            self.client.stop()
+            await asyncio.gather(connection, return_exceptions=True)
+        close()
+        return ready_ms
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless chat client (stdin/stdout or a Unix socket)")
+    parser.add_argument("-u", "--user", help="username (default: the one saved by the GUI)")
+    parser.add_argument("--socket", help="serve a Unix socket at this path instead of stdin/stdout")
+    parser.add_argument("--json", action="store_true", help="write JSON lines instead of text")
+    parser.add_argument("--no-store", action="store_true", help="do not read or write the local history")
+    parser.add_argument("--startup-time", action="store_true", help="report the time to ready and exit")
+    args = parser.parse_args(argv)
+
+    username = args.user
+    if not username:
+        settings_file = os.path.expanduser("~/.chat3")
+        if os.path.exists(settings_file):
+            with open(settings_file, "r") as f:
+                username = f.read().strip()
+    if not username:
+        parser.error("--user is required until a username has been saved")
+    store = None if args.no_store or args.startup_time else MessageStore()
+    if store is not None:
+        threading.Thread(target=store.index_backlog, daemon=True).start()
+    chat = HeadlessChat(username, store=store, as_json=args.json)
+    try:
+        asyncio.run(chat.run(args.socket, args.startup_time))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if store is not None:
+            store.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1110 @@
+"""
+GUI-free core of the chat client: wire crypto, multipart/file reassembly,
+the local message store and the Discord transport. Nothing here imports Qt,
+and discord (the slowest import by far) is only loaded once a connection
+is made, so scripts and the headless client (chat_cli.py) start fast.
+"""
+import os
+import asyncio
+import threading
+import time
+import json
+import base64
+import hashlib
+import hmac
+import math
+import random
+import re
+import struct
+import sqlite3
+import tempfile
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from tgcrypto import ige256_encrypt, ige256_decrypt
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+
+# --- AES-256-GCM Parameters ---
+GCM_KEY = bytes.fromhex("adf0de6ffdf5484bd03f34264c1ed536646afd85eeaf6206fc7da262d7cf660f")
+GCM_IV  = bytes.fromhex("9569eece25da9445e3864e2a")  # 12 bytes for GCM
+
+# --- AES-256-IGE Parameters ---
+IGE_KEY = bytes.fromhex("64177f070bd33f66971ece6b61e5e71af1693e1e348f79cdd679b16c07329a86")
+IGE_IV  = bytes.fromhex("04af51b262ae169a499378397805feb097165222b0b582870be50ffa97d21053")
+
+# --- Discord Hardcoded credentials ---
+DISCORD_TOKEN = ""  # CHANGE THIS!
+DISCORD_CHANNELS = {  # CHANGE TO YOUR CHANNEL IDS! channel id -> room name, all served by one connection
+    # 123456789012345678: "general",
+}
+# Optional, merged over DISCORD_CHANNELS: [{"id": ..., "name": ..., "key": "<64 hex chars>"}].
+# A channel with a "key" uses it instead of GCM_KEY for its envelopes and files.
+CHANNELS_PATH = os.path.expanduser("~/.chat3_channels.json")
+DISCORD_MAX_MESSAGE = 2000  # Discord's per-message character limit
+
+# --- History ---
+HISTORY_LIMIT = 30      # messages fetched on first connect when the local store is empty
+HISTORY_PAGE = 100      # messages per page when scrolling up
+STORE_PATH = os.path.expanduser("~/.chat3_history.db")
+STORE_KEY_PATH = os.path.expanduser("~/.chat3_store.key")
+
+# --- Multipart messages and attachments ---
+CHUNK_TIMEOUT = 120          # seconds a partial multipart message is kept
+CHUNK_MAX_PENDING = 64       # partial messages kept at once; the oldest are dropped
+CHUNK_MAX_BYTES = 4 << 20    # total bytes buffered for partial messages
+FILE_BLOCK = 64 << 10        # plaintext bytes per encrypted file record
+ATTACHMENT_PART_SIZE = 8 << 20  # bytes per uploaded attachment (Discord's free limit is 10 MiB)
+FILE_TIMEOUT = 600
+DOWNLOAD_DIR = os.path.expanduser("~/Downloads/chat3")
+
+# --- Batch decryption ---
+DECRYPT_WORKERS = min(4, os.cpu_count() or 1)
+DECRYPT_BATCH = 64       # payloads per worker task during backfill
+SENDER_CACHE_SIZE = 1024  # decrypted legacy usernames kept, keyed by their ciphertext
+
+# --- Gateway reconnects ---
+RECONNECT_BASE = 1.0     # first backoff ceiling, seconds; doubles per failed attempt
+RECONNECT_MAX = 60.0
+RECONNECT_RESET = 60.0   # a connection that lasted this long resets the backoff
+SHUTDOWN_TIMEOUT_MS = 5000
+
+# --- History search ---
+SEARCH_PREFIX_MIN = 2    # shortest indexed (and searchable) word prefix
+SEARCH_PREFIX_MAX = 8    # longer query words match on this prefix, then are checked against the text
+SEARCH_PAGE = 50         # results per page
+SEARCH_SCAN_LIMIT = 250  # candidate rows decrypted per search() call before it returns a continuation
+INDEX_VERSION = 2        # bumped when the indexed terms change; older stores are reindexed
+INDEX_BATCH = 500        # rows stored or indexed per transaction by add_many() and index_backlog()
+TERM_CACHE_SIZE = 1 << 16  # hashed index terms kept per store
+DISCORD_EPOCH_MS = 1420070400000
+
+# ---- ENCRYPTION FUNCTIONS ----
+def pad(data):
+    pad_len = 16 - (len(data) % 16)
+    return data + bytes([pad_len] * pad_len)
+
+def unpad(data):
+    pad_len = data[-1]
+    if not 1 <= pad_len <= 16:
+        raise ValueError("Invalid padding")
+    return data[:-pad_len]
+
+def aes_gcm_encrypt(plaintext):
+    cipher = AES.new(GCM_KEY, AES.MODE_GCM, nonce=GCM_IV)
+    ciphertext, tag = cipher.encrypt_and_digest(plaintext)
+    return ciphertext, tag
+
+def aes_gcm_decrypt(ciphertext, tag):
+    cipher = AES.new(GCM_KEY, AES.MODE_GCM, nonce=GCM_IV)
+    plaintext = cipher.decrypt_and_verify(ciphertext, tag)
+    return plaintext
+
+# --- Wire envelope (v2) ---
+# base64url( version:1 | flags:1 | sender_id:4 | nonce:12 | AES-256-GCM(name_len:1 | name | body) | tag:16 )
+# The header is authenticated as associated data. The version byte makes every
+# v2 payload start with "A", which legacy hex payloads ([0-9a-f]) never do.
+ENVELOPE_V2 = 0x02
+ENVELOPE_HEADER = 18
+FLAG_CHUNK = 0x01       # body = chunk_id:8 | index:2 | total:2 | fragment
+FLAG_ATTACHMENT = 0x02  # body = file_id:8 | part:2 | parts:2 | first_record:4 | size:8 | name
+CHUNK_HEADER = 12
+ATTACHMENT_HEADER = 24
+FILE_RECORD_OVERHEAD = 32  # length:4 | nonce:12 | ... | tag:16
+
+def sender_id(username, key=GCM_KEY):
+    # Stable 4-byte tag for the sender, keyed so it reveals nothing without the channel key
+    return hmac.new(key, b"sender:" + username.encode(), hashlib.sha256).digest()[:4]
+
+def seal_envelope(username, body, flags=0, key=GCM_KEY):
+    name = username.encode()[:255]
+    header = bytes([ENVELOPE_V2, flags]) + sender_id(username, key) + get_random_bytes(12)
+    cipher = AES.new(key, AES.MODE_GCM, nonce=header[6:18])
+    cipher.update(header)
+    ciphertext, tag = cipher.encrypt_and_digest(bytes([len(name)]) + name + body)
+    return base64.urlsafe_b64encode(header + ciphertext + tag).rstrip(b"=").decode()
+
+def open_envelope(text, key=GCM_KEY):
+    """
+    Returns (flags, username, body bytes); legacy payloads come back with
+    flags 0. Legacy v1 predates channel keys, so it is only accepted on
+    channels that still use the global key.
+    """
+    if text[:1] in "0123456789abcdef":
+        if key != GCM_KEY:
+            raise ValueError("Legacy payload on a keyed channel")
+        username, msg = combo_decrypt_legacy(text)
+        return 0, username, msg.encode()
+    data = base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+    if len(data) < ENVELOPE_HEADER + 17 or data[0] != ENVELOPE_V2:
+        raise ValueError("Unknown envelope version")
+    header = data[:ENVELOPE_HEADER]
+    cipher = AES.new(key, AES.MODE_GCM, nonce=header[6:18])
+    cipher.update(header)
+    plain = cipher.decrypt_and_verify(data[ENVELOPE_HEADER:-16], data[-16:])
+    name_len = plain[0]
+    return header[1], plain[1:1 + name_len].decode(errors='replace'), plain[1 + name_len:]
+
+def combo_encrypt(username, message, key=GCM_KEY):
+    return seal_envelope(username, message.encode(), key=key)
+
+def combo_decrypt(text, key=GCM_KEY):
+    flags, username, body = open_envelope(text, key)
+    if flags:
+        raise ValueError("Multipart payload; use open_envelope")
+    return username, body.decode(errors='replace')
+
+def decrypt_many(texts, key=GCM_KEY):
+    """open_envelope over a batch; a payload that fails yields its exception instead of raising."""
+    results = []
+    for text in texts:
+        try:
+            results.append(open_envelope(text, key))
+        except Exception as e:
+            results.append(e)
+    return results
+
+def split_message(username, message, limit=DISCORD_MAX_MESSAGE, key=GCM_KEY):
+    """Encrypt `message` as one payload, or as FLAG_CHUNK parts that each fit in `limit` chars."""
+    text = combo_encrypt(username, message, key)
+    if len(text) <= limit:
+        return [text]
+    data = message.encode()
+    room = limit * 3 // 4 - ENVELOPE_HEADER - 16 - 1 - len(username.encode()[:255]) - CHUNK_HEADER
+    total = math.ceil(len(data) / room)
+    if total > 0xFFFF:
+        raise ValueError("Message too long")
+    chunk_id = get_random_bytes(8)
+    return [
+        seal_envelope(username, chunk_id + struct.pack(">HH", i, total) + data[i * room:(i + 1) * room], FLAG_CHUNK, key)
+        for i in range(total)
+    ]
+
+def file_part_count(path, part_size=ATTACHMENT_PART_SIZE):
+    records = max(1, math.ceil(os.path.getsize(path) / FILE_BLOCK))
+    per_part = max(1, part_size // (FILE_BLOCK + FILE_RECORD_OVERHEAD))
+    return math.ceil(records / per_part)
+
+def seal_file_parts(username, path, part_size=ATTACHMENT_PART_SIZE, key=GCM_KEY):
+    """
+    Encrypt `path` as a stream of FILE_BLOCK records, one GCM seal each, and
+    yield (envelope, part_path) per attachment part. Only one block is in
+    memory at a time; the caller uploads and deletes each part file.
+    """
+    file_id = get_random_bytes(8)
+    size = os.path.getsize(path)
+    n_records = max(1, math.ceil(size / FILE_BLOCK))
+    per_part = max(1, part_size // (FILE_BLOCK + FILE_RECORD_OVERHEAD))
+    parts = math.ceil(n_records / per_part)
+    name = os.path.basename(path).encode()[:200]
+    with open(path, "rb") as src:
+        for part in range(parts):
+            first = part * per_part
+            with tempfile.NamedTemporaryFile(prefix="chat3-", suffix=".bin", delete=False) as out:
+                for rec in range(first, min(first + per_part, n_records)):
+                    nonce = get_random_bytes(12)
+                    cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+                    cipher.update(file_id + struct.pack(">IB", rec, rec == n_records - 1))
+                    ciphertext, tag = cipher.encrypt_and_digest(src.read(FILE_BLOCK))
+                    out.write(struct.pack(">I", len(ciphertext)) + nonce + ciphertext + tag)
+            meta = file_id + struct.pack(">HHIQ", part, parts, first, size) + name
+            yield seal_envelope(username, meta, FLAG_ATTACHMENT, key), out.name
+
+def parse_attachment_meta(body):
+    file_id = body[:8]
+    part, parts, first, size = struct.unpack(">HHIQ", body[8:ATTACHMENT_HEADER])
+    return file_id, part, parts, first, size, body[ATTACHMENT_HEADER:].decode(errors='replace')
+
+def combo_encrypt_legacy(username, message):
+    # v1: hex(IGE(pad(GCM(hex(GCM(username)) | message)))) with a fixed nonce
+    enc_username = aes_gcm_encrypt(username.encode())[0].hex()
+    data = f"{enc_username}|{message}"
+    gcm_ciphertext, tag = aes_gcm_encrypt(data.encode())
+    ige_input = pad(gcm_ciphertext + tag)
+    ige_ciphertext = ige256_encrypt(ige_input, IGE_KEY, IGE_IV)
+    return ige_ciphertext.hex()
+
+def combo_decrypt_legacy(hex_input):
+    ige_ciphertext = bytes.fromhex(hex_input)
+    ige_plain = ige256_decrypt(ige_ciphertext, IGE_KEY, IGE_IV)
+    gcm_output = unpad(ige_plain)
+    gcm_ciphertext, tag = gcm_output[:-16], gcm_output[-16:]
+    plain = aes_gcm_decrypt(gcm_ciphertext, tag)
+    s = plain.decode(errors='replace')
+    parts = s.split("|", 1)
+    if len(parts) == 2:
+        enc_username, msg = parts
+        return legacy_username(enc_username), msg
+    else:
+        return "<unknown>", s
+
+@lru_cache(maxsize=SENDER_CACHE_SIZE)
+def legacy_username(enc_username):
+    # v1 encrypts names with a fixed nonce, so the ciphertext is a stable cache key.
+    # v1 never transmitted the username's tag, so it can only be decrypted, not verified.
+    try:
+        username = AES.new(GCM_KEY, AES.MODE_GCM, nonce=GCM_IV).decrypt(bytes.fromhex(enc_username))
+        return username.decode(errors='replace')
+    except Exception:
+        return "<error>"
+
+# ---- CHANNELS ----
+Channel = namedtuple("Channel", "channel_id name key")
+
+def load_channels(path=CHANNELS_PATH):
+    """DISCORD_CHANNELS plus the optional channels file, as {channel id: Channel}."""
+    channels = {cid: Channel(cid, name, GCM_KEY) for cid, name in DISCORD_CHANNELS.items()}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            for entry in json.load(f):
+                cid = int(entry["id"])
+                key = bytes.fromhex(entry["key"]) if entry.get("key") else GCM_KEY
+                channels[cid] = Channel(cid, entry.get("name") or str(cid), key)
+    return channels
+
+def save_channels(channels, path=CHANNELS_PATH):
+    entries = []
+    for ch in channels.values():
+        entry = {"id": ch.channel_id, "name": ch.name}
+        if ch.key != GCM_KEY:
+            entry["key"] = ch.key.hex()
+        entries.append(entry)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(entries, f, indent=1)
+
+def discard_file(path):
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# ---- MULTIPART REASSEMBLY ----
+class ChunkAssembler:
+    """
+    Rebuilds FLAG_CHUNK messages. Bounded by CHUNK_MAX_PENDING messages and
+    CHUNK_MAX_BYTES buffered bytes (oldest dropped first); partial messages
+    expire after CHUNK_TIMEOUT seconds.
+    """
+    def __init__(self, timeout=CHUNK_TIMEOUT, max_pending=CHUNK_MAX_PENDING, max_bytes=CHUNK_MAX_BYTES):
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.max_bytes = max_bytes
+        self.pending = {}  # (username, chunk_id) -> [deadline, total, {index: fragment}]
+        self.size = 0
+
+    def drop(self, key):
+        entry = self.pending.pop(key)
+        self.size -= sum(len(f) for f in entry[2].values())
+        return entry
+
+    def expire(self, now):
+        for key in [k for k, e in self.pending.items() if e[0] < now]:
+            self.drop(key)
+
+    def add(self, username, body, now=None):
+        """Returns the full message once its last chunk arrives, else None."""
+        now = time.monotonic() if now is None else now
+        self.expire(now)
+        chunk_id = body[:8]
+        index, total = struct.unpack(">HH", body[8:CHUNK_HEADER])
+        fragment = body[CHUNK_HEADER:]
+        key = (username, chunk_id)
+        entry = self.pending.get(key)
+        if entry is None:
+            while self.pending and (len(self.pending) >= self.max_pending or self.size + len(fragment) > self.max_bytes):
+                self.drop(next(iter(self.pending)))
+            entry = self.pending[key] = [now + self.timeout, total, {}]
+        if index >= entry[1] or index in entry[2]:
+            return None
+        entry[2][index] = fragment
+        self.size += len(fragment)
+        if len(entry[2]) < entry[1]:
+            return None
+        self.drop(key)
+        return b"".join(entry[2][i] for i in range(entry[1])).decode(errors='replace')
+
+
+class FileAssembler:
+    """
+    Decrypts attachment parts straight into a .part file under `directory`,
+    one record at a time, and renames it when every part has arrived.
+    Incomplete files are removed after FILE_TIMEOUT seconds. Records are
+    opened with `key` (the channel's key).
+    """
+    def __init__(self, directory=DOWNLOAD_DIR, timeout=FILE_TIMEOUT, key=GCM_KEY):
+        self.directory = directory
+        self.timeout = timeout
+        self.key = key
+        self.lock = threading.Lock()
+        self.pending = {}  # (username, file_id) -> [deadline, path, parts_left]
+
+    def expire(self, now):
+        for key in [k for k, e in self.pending.items() if e[0] < now]:
+            try:
+                os.remove(self.pending.pop(key)[1] + ".part")
+            except OSError:
+                pass
+
+    def target_path(self, name):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.basename(name).strip() or "file"
+        path = os.path.join(self.directory, base)
+        stem, ext = os.path.splitext(path)
+        n = 1
+        while os.path.exists(path) or os.path.exists(path + ".part"):
+            path = f"{stem} ({n}){ext}"
+            n += 1
+        return path
+
+    def add(self, username, meta, data, now=None):
+        """Writes one decrypted part; returns the saved path once the file is complete."""
+        file_id, part, parts, first, size, name = parse_attachment_meta(meta)
+        n_records = max(1, math.ceil(size / FILE_BLOCK))
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.expire(now)
+            key = (username, file_id)
+            entry = self.pending.get(key)
+            if entry is None:
+                path = self.target_path(name)
+                with open(path + ".part", "wb") as f:
+                    f.truncate(size)
+                entry = self.pending[key] = [now + self.timeout, path, set(range(parts))]
+        with open(entry[1] + ".part", "r+b") as f:
+            pos, rec = 0, first
+            while pos < len(data):
+                (length,) = struct.unpack(">I", data[pos:pos + 4])
+                nonce = data[pos + 4:pos + 16]
+                ciphertext = data[pos + 16:pos + 16 + length]
+                tag = data[pos + 16 + length:pos + 32 + length]
+                cipher = AES.new(self.key, AES.MODE_GCM, nonce=nonce)
+                cipher.update(file_id + struct.pack(">IB", rec, rec == n_records - 1))
+                f.seek(rec * FILE_BLOCK)
+                f.write(cipher.decrypt_and_verify(ciphertext, tag))
+                pos += FILE_RECORD_OVERHEAD + length
+                rec += 1
+        with self.lock:
+            entry[2].discard(part)
+            if entry[2] or self.pending.get(key) is not entry:
+                return None
+            del self.pending[key]
+        os.replace(entry[1] + ".part", entry[1])
+        return entry[1]
+
+# ---- HISTORY SEARCH ----
+WORD = re.compile(r"\w+")
+SearchQuery = namedtuple("SearchQuery", "words sender since until")
+
+def snowflake_at(dt):
+    """Smallest Discord message id at or after `dt` (naive datetimes are UTC, like stored timestamps)."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return max(0, int(dt.timestamp() * 1000) - DISCORD_EPOCH_MS) << 22
+
+def parse_query(text):
+    """
+    "words from:name since:2024-01-01 until:2024-02-01T12:00" -> SearchQuery.
+    Every word must start a word of the message; `until` is exclusive.
+    Words shorter than SEARCH_PREFIX_MIN are ignored. Raises ValueError
+    on a bad date.
+    """
+    words, sender, since, until = [], None, None, None
+    for token in text.split():
+        field, _, value = token.partition(":")
+        if field == "from" and value:
+            sender = value.lower()
+        elif field in ("since", "until") and value:
+            dt = datetime.fromisoformat(value)
+            if field == "since":
+                since = dt
+            else:
+                until = dt
+        else:
+            words.extend(w for w in WORD.findall(token.lower()) if len(w) >= SEARCH_PREFIX_MIN)
+    return SearchQuery(list(dict.fromkeys(words)), sender, since, until)
+
+def matches_words(words, message):
+    tokens = WORD.findall(message.lower())
+    return all(any(t.startswith(w) for t in tokens) for w in words)
+
+# ---- LOCAL MESSAGE STORE ----
+class MessageStore:
+    """
+    SQLite history of already-decrypted messages, keyed by
+    (channel, Discord message id, part) so a batched Discord message maps to
+    several rows. Rows are sealed with AES-GCM under a local key, one fresh
+    nonce each. Safe to share between the client's loop thread and the GUI.
+
+    Rows are indexed for search as they are added. The postings table maps
+    a keyed 64-bit hash of every word prefix (SEARCH_PREFIX_MIN to
+    SEARCH_PREFIX_MAX chars) and of "from:<sender>" to the rows containing
+    it, so the index holds no plaintext. That is up to seven terms a word,
+    about 1.5 KB of index for a ten-word message, several times the sealed
+    row itself. Keyed by (channel, term, msg_id, part), a query is an index
+    seek plus an ordered scan, newest first, whatever the history size.
+    Rows stored before the index existed, or under an older INDEX_VERSION,
+    have indexed = 0 until index_backlog() reaches them.
+    """
+    def __init__(self, path=STORE_PATH, key_path=STORE_KEY_PATH):
+        self.key = self.load_key(key_path)
+        self.index_key = hmac.new(self.key, b"chat3 search index", hashlib.sha256).digest()
+        self.term_id = lru_cache(maxsize=TERM_CACHE_SIZE)(self.term_id)  # vocabularies repeat a lot
+        self.lock = threading.Lock()
+        self.closed = False
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " channel_id INTEGER, msg_id INTEGER, part INTEGER, ts TEXT, body BLOB, indexed INTEGER NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (channel_id, msg_id, part)) WITHOUT ROWID"
+        )
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(messages)")]
+        if "indexed" not in columns:
+            self.db.execute("ALTER TABLE messages ADD COLUMN indexed INTEGER NOT NULL DEFAULT 0")
+        self.db.execute("CREATE INDEX IF NOT EXISTS messages_ts ON messages (channel_id, ts)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS messages_unindexed ON messages (channel_id) WHERE indexed = 0")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] < INDEX_VERSION:
+            # Postings already there stay valid; index_backlog() adds the missing terms
+            self.db.execute("UPDATE messages SET indexed = 0")
+            self.db.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            " channel_id INTEGER, term INTEGER, msg_id INTEGER, part INTEGER,"
+            " PRIMARY KEY (channel_id, term, msg_id, part)) WITHOUT ROWID"
+        )
+        self.db.commit()
+
+    @staticmethod
+    def load_key(key_path):
+        if os.path.exists(key_path):
+            with open(key_path, "rb") as f:
+                return f.read()
+        key = get_random_bytes(32)
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(key)
+        return key
+
+    def seal(self, username, message):
+        nonce = get_random_bytes(12)
+        cipher = AES.new(self.key, AES.MODE_GCM, nonce=nonce)
+        ciphertext, tag = cipher.encrypt_and_digest(f"{username}\0{message}".encode())
+        return nonce + tag + ciphertext
+
+    def open(self, body):
+        cipher = AES.new(self.key, AES.MODE_GCM, nonce=body[:12])
+        plain = cipher.decrypt_and_verify(body[28:], body[12:28]).decode(errors='replace')
+        return plain.split("\0", 1)
+
+    def term_id(self, term):
+        digest = hashlib.blake2b(term.encode(), key=self.index_key, digest_size=8).digest()
+        return int.from_bytes(digest, "big", signed=True)
+
+    def index_terms(self, username, message):
+        terms = {"from:" + username.lower()}
+        for word in set(WORD.findall(message.lower())):
+            for n in range(SEARCH_PREFIX_MIN, min(len(word), SEARCH_PREFIX_MAX) + 1):
+                terms.add(word[:n])
+        return [self.term_id(term) for term in terms]
+
+    def postings(self, channel_id, msg_id, part, username, message):
+        return [(channel_id, term, msg_id, part) for term in self.index_terms(username, message)]
+
+    def add_many(self, channel_id, rows):
+        """Store and index ((msg_id, part), ts, username, message) rows; returns the ones that were new."""
+        # Sealing and hashing happen before taking the lock, so searches and
+        # history pages only wait for the writes, one INDEX_BATCH at a time
+        prepared = [(row, self.seal(row[2], row[3]), self.postings(channel_id, *row[0], row[2], row[3]))
+                    for row in rows]
+        added = []
+        for i in range(0, len(prepared), INDEX_BATCH):
+            postings = []
+            with self.lock:
+                for row, body, row_postings in prepared[i:i + INDEX_BATCH]:
+                    (msg_id, part), ts = row[:2]
+                    cur = self.db.execute("INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?, 1)",
+                                          (channel_id, msg_id, part, ts, body))
+                    if cur.rowcount:
+                        added.append(row)
+                        postings.extend(row_postings)
+                self.db.executemany("INSERT OR IGNORE INTO postings VALUES (?, ?, ?, ?)", postings)
+                self.db.commit()
+        return added
+
+    def index_pending(self, limit=INDEX_BATCH):
+        """Index up to `limit` rows stored before the index existed; returns how many were done."""
+        with self.lock:
+            if self.closed:
+                return 0
+            rows = self.db.execute(
+                "SELECT channel_id, msg_id, part, body FROM messages WHERE indexed = 0 LIMIT ?", (limit,)).fetchall()
+        postings = []
+        for channel_id, msg_id, part, body in rows:
+            try:
+                postings.extend(self.postings(channel_id, msg_id, part, *self.open(body)))
+            except Exception:
+                pass  # unreadable row: mark it anyway rather than retry forever
+        with self.lock:
+            if self.closed:
+                return 0
+            self.db.executemany("INSERT OR IGNORE INTO postings VALUES (?, ?, ?, ?)", postings)
+            self.db.executemany("UPDATE messages SET indexed = 1 WHERE channel_id = ? AND msg_id = ? AND part = ?",
+                                [row[:3] for row in rows])
+            self.db.commit()
+        return len(rows)
+
+    def index_backlog(self, batch=INDEX_BATCH):
+        """Index every pre-index row, one short transaction at a time; run it on a background thread."""
+        while self.index_pending(batch):
+            pass
+
+    def search(self, channel_id, query, before=None, limit=SEARCH_PAGE):
+        """
+        One page of rows of `channel_id` matching `query` (a SearchQuery),
+        newest first, as ((msg_id, part), ts, username, message). Returns
+        (rows, next_before): pass next_before back for the following page;
+        it is None once there are no more. At most SEARCH_SCAN_LIMIT
+        candidates are checked per call, so when long words or hash
+        collisions make most candidates miss, the page may come back short
+        (even empty) with a next_before to continue from. A query with no
+        words or sender pages through the time range alone. Once the store
+        is closed it returns no rows.
+        """
+        words = sorted(query.words, key=len, reverse=True)  # the longest word is likely the rarest: drive with it
+        terms = [self.term_id(w[:SEARCH_PREFIX_MAX]) for w in words]
+        if query.sender:
+            terms.append(self.term_id("from:" + query.sender))
+        low = snowflake_at(query.since) if query.since else 0
+        if before is None:
+            before = (snowflake_at(query.until), 0) if query.until else ((1 << 63) - 1, 0)
+        if terms:
+            sql = ("SELECT m.msg_id, m.part, m.ts, m.body FROM postings p JOIN messages m"
+                   " ON m.channel_id = p.channel_id AND m.msg_id = p.msg_id AND m.part = p.part"
+                   " WHERE p.channel_id = ? AND p.term = ? AND (p.msg_id, p.part) < (?, ?) AND p.msg_id >= ?"
+                   + " AND EXISTS (SELECT 1 FROM postings q WHERE q.channel_id = p.channel_id AND q.term = ?"
+                     " AND q.msg_id = p.msg_id AND q.part = p.part)" * (len(terms) - 1)
+                   + " ORDER BY p.msg_id DESC, p.part DESC LIMIT ?")
+            head, rest = [channel_id, terms[0]], terms[1:]
+        else:
+            sql = ("SELECT msg_id, part, ts, body FROM messages WHERE channel_id = ? AND (msg_id, part) < (?, ?)"
+                   " AND msg_id >= ? ORDER BY msg_id DESC, part DESC LIMIT ?")
+            head, rest = [channel_id], []
+        rows, scanned = [], 0
+        while True:
+            if scanned >= SEARCH_SCAN_LIMIT:
+                return rows, before
+            with self.lock:
+                if self.closed:
+                    return rows, None
+                batch = self.db.execute(sql, (*head, before[0], before[1], low, *rest, limit)).fetchall()
+            scanned += len(batch)
+            for msg_id, part, ts, body in batch:
+                before = (msg_id, part)
+                username, message = self.open(body)
+                # Hashes only narrow it down: long words and hash collisions are checked on the text
+                if (query.sender and username.lower() != query.sender) or not matches_words(words, message):
+                    continue
+                rows.append(((msg_id, part), ts, username, message))
+                if len(rows) == limit:
+                    return rows, before
+            if len(batch) < limit:
+                return rows, None
+
+    def last_id(self, channel_id):
+        with self.lock:
+            row = self.db.execute("SELECT MAX(msg_id) FROM messages WHERE channel_id = ?", (channel_id,)).fetchone()
+        return row[0]
+
+    def latest(self, channel_id, limit):
+        return self.page(channel_id, None, limit)
+
+    def page(self, channel_id, before, limit):
+        """Up to `limit` rows older than the (msg_id, part) key `before`, oldest first."""
+        with self.lock:
+            if before is None:
+                cur = self.db.execute(
+                    "SELECT msg_id, part, ts, body FROM messages WHERE channel_id = ?"
+                    " ORDER BY msg_id DESC, part DESC LIMIT ?", (channel_id, limit))
+            else:
+                cur = self.db.execute(
+                    "SELECT msg_id, part, ts, body FROM messages WHERE channel_id = ? AND (msg_id, part) < (?, ?)"
+                    " ORDER BY msg_id DESC, part DESC LIMIT ?", (channel_id, before[0], before[1], limit))
+            rows = cur.fetchall()
+        return [((msg_id, part), ts, *self.open(body)) for msg_id, part, ts, body in reversed(rows)]
+
+    def page_after(self, channel_id, after, limit):
+        """Up to `limit` rows newer than the (msg_id, part) key `after`, oldest first."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT msg_id, part, ts, body FROM messages WHERE channel_id = ? AND (msg_id, part) > (?, ?)"
+                " ORDER BY msg_id, part LIMIT ?", (channel_id, after[0], after[1], limit)).fetchall()
+        return [((msg_id, part), ts, *self.open(body)) for msg_id, part, ts, body in rows]
+
+    def clear(self, channel_id):
+        with self.lock:
+            self.db.execute("DELETE FROM messages WHERE channel_id = ?", (channel_id,))
+            self.db.execute("DELETE FROM postings WHERE channel_id = ?", (channel_id,))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.db.close()
+
+# ---- TRANSPORT ----
+class Event:
+    """
+    Minimal stand-in for a Qt signal: connect() callables, emit() calls them
+    in order on the emitting thread (the client's loop thread). GUI code
+    hands them on to the GUI thread (chat.GuiQueue).
+    """
+    def __init__(self):
+        self.handlers = []
+
+    def connect(self, handler):
+        self.handlers.append(handler)
+
+    def emit(self, *args):
+        for handler in self.handlers:
+            handler(*args)
+
+
+class ChatClient:
+    """
+    One gateway connection for every subscribed channel. Messages are routed
+    by channel id; anything outside self.channels is ignored before
+    decryption, and each channel decrypts with its own key, chunk
+    reassembler and file assembler. Results are reported through Event
+    attributes, so the same client drives the Qt window and chat_cli.py.
+    discord is imported on first connect, not with this module.
+    `client_class` replaces discord.Client as the base of the connection
+    (chat_bench.py runs against a local stand-in this way).
+    """
+    # Discord allows about 5 messages per 5 s per channel; several queued
+    # payloads are packed into one Discord message (one per line) and batches
+    # are spaced SEND_INTERVAL apart.
+    SEND_BATCH_SIZE = 5
+    SEND_INTERVAL = 1.0
+    SEND_RETRIES = 3
+    SEND_RETRY_DELAY = 1.0
+
+    def __init__(self, token, channels, self_user, store=None, client_class=None):
+        self.token = token
+        self.client_class = client_class
+        # {channel id: Channel}; replaced as a whole on (un)subscribe, so the loop reads it without a lock
+        self.channels = {}
+        self.chunks = {}
+        self.files = {}
+        # Per channel, the Discord id up to which nothing is missing. The next
+        # sync fetches what came after it. Live messages only advance it once
+        # the channel's sync has finished (it is not in `syncing`), or the
+        # sync would skip what arrived between the stored rows and them.
+        self.watermarks = {}
+        self.syncing = set()
+        self.self_user = self_user
+        self.store = store
+        self.client = None
+        self.running = True
+        self.stopping = None
+        self.message_received = Event()  # channel id, timestamp, username, message
+        # channel id, [(key, timestamp, username, message)], True if older than the view,
+        # and for older pages the oldest Discord id fetched (None if there was none)
+        self.history_loaded = Event()
+        self.file_received = Event()  # channel id, username, saved path
+        self.error_signal = Event()  # message
+        self.reconnecting_signal = Event()
+        self.send_status = Event()  # send id, "queued"/"sent"/"retrying"/"failed", detail
+        # main() owns one asyncio loop for its whole life; other threads only
+        # reach it through call_soon_threadsafe/run_coroutine_threadsafe.
+        self.send_lock = threading.Lock()
+        self.outbox = deque()
+        self.send_inflight = []
+        self.send_parts = {}  # send id -> parts still to deliver
+        self.send_seq = 0
+        self.loop = None
+        self.send_wakeup = None
+        for channel in channels.values():
+            self.subscribe(channel)
+        self.decrypt_pool = ThreadPoolExecutor(max_workers=DECRYPT_WORKERS, thread_name_prefix="decrypt")
+
+    def run(self):
+        """Blocking: run the connection on a fresh loop until stop()."""
+        # asyncio.run cancels leftover tasks and closes the loop and its executor on the way out
+        try:
+            asyncio.run(self.main())
+        except Exception as e:
+            self.error_signal.emit(f"Discord error: {e}")
+
+    async def main(self):
+        """
+        Log in once, then keep one gateway connection up. discord.py resumes
+        the session itself after drops (missed events are replayed); when it
+        gives up, connect() is retried with full-jitter exponential backoff
+        on the same logged-in client, never a rebuilt one.
+        """
+        import discord
+        loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        client = self.make_client()
+        with self.send_lock:
+            self.client = client
+            self.loop = loop
+            self.send_wakeup = asyncio.Event()
+            if self.outbox:
+                self.send_wakeup.set()
+        attempt = 0
+        try:
+            async with client:
+                await client.login(self.token)
+                while self.running:
+                    started = loop.time()
+                    try:
+                        await client.connect(reconnect=True)
+                    except (discord.LoginFailure, discord.PrivilegedIntentsRequired):
+                        raise
+                    except Exception as e:
+                        if self.running:
+                            self.error_signal.emit(f"Discord error: {e}")
+                    if not self.running or client.is_closed():
+                        break
+                    if loop.time() - started > RECONNECT_RESET:
+                        attempt = 0
+                    delay = random.uniform(0, min(RECONNECT_MAX, RECONNECT_BASE * 2 ** attempt))
+                    attempt += 1
+                    self.reconnecting_signal.emit()
+                    try:
+                        await asyncio.wait_for(self.stopping.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+        except (discord.LoginFailure, discord.PrivilegedIntentsRequired) as e:
+            self.error_signal.emit(f"Discord login failed: {e}")
+        finally:
+            task = getattr(client, "send_task", None)
+            if task is not None:
+                task.cancel()
+            self.reclaim_unsent()
+            # Not the loop's default executor, so asyncio.run does not shut it down
+            self.decrypt_pool.shutdown(wait=False, cancel_futures=True)
+
+    def make_client(self):
+        import discord
+        intents = discord.Intents.default()
+        intents.message_content = True
+
+        class DiscordBot(self.client_class or discord.Client):
+            async def setup_hook(botself):
+                botself.send_task = asyncio.create_task(self.send_worker(botself))
+
+            async def on_ready(botself):
+                self.syncing.update(self.channels)
+                await asyncio.gather(*(self.sync_channel(botself, ch) for ch in self.channels.values()))
+
+            async def on_message(botself, message):
+                channel = self.channels.get(message.channel.id)
+                if channel is None or not message.author.bot:
+                    return
+                attachments = []
+                rows = self.decode_message(message, channel, attachments=attachments)
+                # SQLite stays off the loop thread
+                for key, ts, username, payload in await asyncio.to_thread(self.store_rows, channel.channel_id, rows):
+                    self.message_received.emit(channel.channel_id, ts, username, payload)
+                if channel.channel_id not in self.syncing:
+                    self.watermarks[channel.channel_id] = max(message.id, self.watermarks.get(channel.channel_id) or 0)
+                for username, meta, attachment in attachments:
+                    await self.receive_file(channel, username, meta, attachment)
+
+        return DiscordBot(intents=intents)
+
+    def subscribe(self, channel):
+        """Start routing `channel` (a Channel); callable from any thread. Backfills if connected."""
+        cid = channel.channel_id
+        self.chunks.setdefault(cid, ChunkAssembler())
+        self.files[cid] = FileAssembler(key=channel.key)
+        # Read before routing starts, so no live message can be stored ahead of it
+        if cid not in self.watermarks:
+            self.watermarks[cid] = self.store.last_id(cid) if self.store else None
+        self.syncing.add(cid)
+        self.channels = {**self.channels, cid: channel}
+        loop, client = self.loop, self.client
+        if loop is not None and client is not None and client.is_ready():
+            asyncio.run_coroutine_threadsafe(self.sync_channel(client, channel), loop)
+
+    def unsubscribe(self, channel_id):
+        """Stop routing and decrypting a channel; its queued sends still go out."""
+        self.channels = {cid: ch for cid, ch in self.channels.items() if cid != channel_id}
+
+    async def sync_channel(self, client, channel):
+        # Only what arrived since the watermark; the view was already filled
+        # from the local store. A failed sync leaves the channel in `syncing`,
+        # so the watermark stays put for the next attempt.
+        import discord
+        cid = channel.channel_id
+        try:
+            target = client.get_channel(cid) or await client.fetch_channel(cid)
+            last_id = self.watermarks.get(cid)
+            if last_id:
+                history = target.history(limit=None, after=discord.Object(id=last_id), oldest_first=True)
+            else:
+                history = target.history(limit=HISTORY_LIMIT, oldest_first=True)
+            fetched = [msg async for msg in history]
+            rows = await self.decode_batch([msg for msg in fetched if msg.author.bot], channel)
+            await self.publish(cid, rows, False)
+            if fetched:
+                self.watermarks[cid] = max(fetched[-1].id, self.watermarks.get(cid) or 0)
+            self.syncing.discard(cid)
+        except Exception as e:
+            self.error_signal.emit(f"Error fetching history for {channel.name}: {e}")
+
+    def decode_message(self, message, channel, report_errors=True, attachments=None):
+        # A single Discord message may carry several batched payloads, one per line.
+        # Chunks only produce a row once their message is complete; attachment
+        # parts are handed back through `attachments` for download.
+        rows = []
+        for part, payload_text in enumerate(message.content.split()):
+            try:
+                opened = open_envelope(payload_text, channel.key)
+            except Exception as e:
+                opened = e
+            row = self.build_row(message, part, opened, channel, report_errors, attachments)
+            if row:
+                rows.append(row)
+        return rows
+
+    async def decode_batch(self, messages, channel, report_errors=False):
+        """decode_message for a whole backfill: decryption runs on the worker pool, in DECRYPT_BATCH slices."""
+        items = [(msg, part, text) for msg in messages for part, text in enumerate(msg.content.split())]
+        loop = asyncio.get_running_loop()
+        slices = [items[i:i + DECRYPT_BATCH] for i in range(0, len(items), DECRYPT_BATCH)]
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self.decrypt_pool, decrypt_many, [text for _, _, text in chunk], channel.key)
+            for chunk in slices
+        ))
+        rows = []
+        # Reassembly stays on the loop thread, in message order
+        for (msg, part, _), opened in zip(items, (r for chunk in results for r in chunk)):
+            row = self.build_row(msg, part, opened, channel, report_errors)
+            if row:
+                rows.append(row)
+        return rows
+
+    def build_row(self, message, part, opened, channel, report_errors=True, attachments=None):
+        if isinstance(opened, Exception):
+            if report_errors:
+                self.error_signal.emit(f"Error decrypting message: {opened}")
+            return None
+        flags, username, body = opened
+        try:
+            if flags & FLAG_CHUNK:
+                payload = self.chunks[channel.channel_id].add(username, body)
+                if payload is None:
+                    return None
+            elif flags & FLAG_ATTACHMENT:
+                if attachments is not None and message.attachments:
+                    attachments.append((username, body, message.attachments[0]))
+                _, index, _, _, size, name = parse_attachment_meta(body)
+                if index:
+                    return None
+                payload = f"📎 {name} ({size} bytes)"
+            else:
+                payload = body.decode(errors='replace')
+        except Exception as e:
+            if report_errors:
+                self.error_signal.emit(f"Error decrypting message: {e}")
+            return None
+        ts = message.created_at.strftime("%Y-%m-%d %H:%M:%S")
+        return ((message.id, part), ts, username, payload)
+
+    async def receive_file(self, channel, username, meta, attachment):
+        # One part is at most ATTACHMENT_PART_SIZE; decryption runs off the event loop
+        try:
+            data = await attachment.read()
+            path = await asyncio.to_thread(self.files[channel.channel_id].add, username, meta, data)
+            if path:
+                self.file_received.emit(channel.channel_id, username, path)
+        except Exception as e:
+            self.error_signal.emit(f"Error receiving file: {e}")
+
+    def store_rows(self, channel_id, rows):
+        # Drops rows already in the store (e.g. seen before a reconnect)
+        if self.store is None:
+            return rows
+        return self.store.add_many(channel_id, rows)
+
+    async def publish(self, channel_id, rows, older, reached=None):
+        # SQLite stays off the loop thread; the event fires back on it
+        rows = await asyncio.to_thread(self.store_rows, channel_id, rows)
+        if rows or older:
+            self.history_loaded.emit(channel_id, rows, older, reached)
+
+    def fetch_older(self, channel_id, before_id):
+        """Page in HISTORY_PAGE Discord messages older than before_id; callable from the GUI thread."""
+        channel = self.channels.get(channel_id)
+        if self.loop is None or self.client is None or channel is None:
+            return False
+        asyncio.run_coroutine_threadsafe(self.fetch_older_async(self.client, channel, before_id), self.loop)
+        return True
+
+    async def fetch_older_async(self, client, channel, before_id):
+        import discord
+        try:
+            target = client.get_channel(channel.channel_id) or await client.fetch_channel(channel.channel_id)
+            history = target.history(limit=HISTORY_PAGE, before=discord.Object(id=before_id), oldest_first=False)
+            fetched = [msg async for msg in history]
+            # A page may decode to nothing (no bot messages, or none readable); the
+            # next one must still start below it, so the oldest id is reported too
+            reached = fetched[-1].id if fetched else None
+            rows = await self.decode_batch([msg for msg in reversed(fetched) if msg.author.bot], channel)
+            await self.publish(channel.channel_id, rows, True, reached)
+        except Exception as e:
+            self.error_signal.emit(f"Error fetching history: {e}")
+            self.history_loaded.emit(channel.channel_id, [], True, None)
+
+    def emit_on_loop(self, event, *args):
+        # Events only ever fire on the loop thread (Qt aborts when one signal
+        # is emitted from two threads at once); before and after the loop runs
+        # nothing else emits, so the caller's thread is fine then.
+        with self.send_lock:
+            loop = self.loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(event.emit, *args)
+                return
+            except RuntimeError:
+                pass  # loop already finished
+        event.emit(*args)
+
+    def new_send(self, parts):
+        with self.send_lock:
+            self.send_seq += 1
+            send_id = self.send_seq
+            self.send_parts[send_id] = parts
+        self.emit_on_loop(self.send_status, send_id, "queued", "")
+        return send_id
+
+    def enqueue(self, send_id, channel_id, payload, attachment=None):
+        with self.send_lock:
+            self.outbox.append((send_id, channel_id, payload, attachment))
+            loop, wakeup = self.loop, self.send_wakeup
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                pass  # loop is shutting down; the next client picks the message up
+
+    def queue_message(self, channel_id, payloads):
+        """Queue one message (a payload or its list of chunks); safe to call from any thread."""
+        if isinstance(payloads, str):
+            payloads = [payloads]
+        send_id = self.new_send(len(payloads))
+        for payload in payloads:
+            self.enqueue(send_id, channel_id, payload)
+        return send_id
+
+    def queue_file(self, channel, username, path):
+        """Encrypt `path` part by part and queue each part as an attachment; blocking, run off the GUI thread."""
+        send_id = self.new_send(file_part_count(path))
+        try:
+            for payload, part_path in seal_file_parts(username, path, key=channel.key):
+                self.enqueue(send_id, channel.channel_id, payload, part_path)
+        except Exception as e:
+            self.finish_send(send_id, "failed", str(e))
+        return send_id
+
+    def part_sent(self, send_id):
+        with self.send_lock:
+            left = self.send_parts.get(send_id, 1) - 1
+            if left > 0:
+                self.send_parts[send_id] = left
+                return
+            self.send_parts.pop(send_id, None)
+        self.send_status.emit(send_id, "sent", "")
+
+    def finish_send(self, send_id, status, detail):
+        # Remaining parts of a failed message are skipped by take_batch
+        with self.send_lock:
+            if self.send_parts.pop(send_id, None) is None:
+                return
+        self.emit_on_loop(self.send_status, send_id, status, detail)
+
+    def take_batch(self):
+        # Text payloads for the same channel share a Discord message; an attachment part always goes alone
+        batch, size = [], 0
+        with self.send_lock:
+            while self.outbox and len(batch) < self.SEND_BATCH_SIZE:
+                send_id, channel_id, payload, attachment = self.outbox[0]
+                if send_id not in self.send_parts:
+                    self.outbox.popleft()
+                    discard_file(attachment)
+                    continue
+                if batch and (attachment or batch[0][3] or channel_id != batch[0][1]
+                              or size + 1 + len(payload) > DISCORD_MAX_MESSAGE):
+                    break
+                batch.append(self.outbox.popleft())
+                size += len(payload) + 1
+            if not self.outbox:
+                self.send_wakeup.clear()
+            self.send_inflight = batch
+        return batch
+
+    async def send_worker(self, client):
+        await client.wait_until_ready()
+        while not client.is_closed():
+            await self.send_wakeup.wait()
+            batch = self.take_batch()
+            if batch:
+                await self.deliver(client, batch)
+                await asyncio.sleep(self.SEND_INTERVAL)
+
+    async def deliver(self, client, batch):
+        import discord
+        channel_id = batch[0][1]
+        content = "\n".join(payload for _, _, payload, _ in batch)
+        attachment = batch[0][3]
+        send_ids = list(dict.fromkeys(send_id for send_id, _, _, _ in batch))
+        for attempt in range(1, self.SEND_RETRIES + 1):
+            try:
+                channel = client.get_channel(channel_id) or await client.fetch_channel(channel_id)
+                if attachment:
+                    await channel.send(content, file=discord.File(attachment, filename="blob.bin"))
+                else:
+                    await channel.send(content)
+            except Exception as e:
+                if attempt == self.SEND_RETRIES:
+                    for send_id in send_ids:
+                        self.finish_send(send_id, "failed", str(e))
+                    break
+                for send_id in send_ids:
+                    self.send_status.emit(send_id, "retrying", str(e))
+                await asyncio.sleep(self.SEND_RETRY_DELAY * 2 ** (attempt - 1))
+            else:
+                for send_id, _, _, _ in batch:
+                    self.part_sent(send_id)
+                break
+        discard_file(attachment)
+        with self.send_lock:
+            self.send_inflight = []
+
+    def reclaim_unsent(self):
+        # Put a batch that was cut off by shutdown back at the head of the queue
+        with self.send_lock:
+            self.loop = None
+            self.send_wakeup = None
+            self.outbox.extendleft(reversed(self.send_inflight))
+            self.send_inflight = []
+
+    def stop(self):
+        """Ask the loop thread to close the client; returns at once (wait() to join)."""
+        self.running = False
+        loop, client = self.loop, self.client
+        if loop is None or client is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self.stopping.set)
+            asyncio.run_coroutine_threadsafe(client.close(), loop)
+        except RuntimeError:
+            pass  # loop already finished
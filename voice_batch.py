@@ -0,0 +1,170 @@
+"""
+Offline so-vits-svc conversion for long WAV/FLAC files or whole directories.
+
+Files are read block by block in overlapping segments, converted in
+parallel on a pool of resident backends (one so-vits-svc worker process
+each) and written out as they complete, with crossfaded seams. Memory use
+depends on the segment size and worker count, not on the file length.
+No Qt needed:
+
+    python voice_batch.py -s /path/to/so-vits-svc/inference_main.py \
+        -c config.json -m model.pth --transpose 2 in.wav more_audio/ -o out/
+"""
+import argparse
+import os
+import queue
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import soundfile as sf
+
+from voice_engine import SvcBackend, FakeBackend
+
+AUDIO_EXTENSIONS = (".wav", ".flac")
+
+# ----------- Backend pool -------------
+class BackendPool:
+    """`workers` loaded backends; each segment borrows a free one."""
+    def __init__(self, factory, workers=2):
+        self.backends = []
+        self.free = queue.Queue()
+        for _ in range(max(1, workers)):
+            backend = factory()
+            backend.load()
+            self.backends.append(backend)
+            self.free.put(backend)
+        self.executor = ThreadPoolExecutor(max_workers=len(self.backends))
+        self.sample_rate = self.backends[0].sample_rate
+
+    def convert(self, x, input_rate, pitch_shift):
+        backend = self.free.get()
+        try:
+            return backend.convert(x, input_rate, pitch_shift)
+        finally:
+            self.free.put(backend)
+
+    def submit(self, x, input_rate, pitch_shift):
+        return self.executor.submit(self.convert, x, input_rate, pitch_shift)
+
+    def close(self):
+        self.executor.shutdown()
+        for backend in self.backends:
+            backend.close()
+
+# ----------- Streaming segmenter / writer -------------
+def read_segments(f, segment, overlap):
+    """
+    Yield (block, last) from an open SoundFile: `segment` new frames plus the
+    `overlap` frames shared with the next block, downmixed to mono.
+    """
+    block = f.read(segment + overlap, dtype="float32", always_2d=True).mean(axis=1)
+    while len(block):
+        last = f.tell() >= f.frames
+        yield block, last
+        if last:
+            break
+        new = f.read(segment, dtype="float32", always_2d=True).mean(axis=1)
+        if not len(new):
+            break
+        block = np.concatenate([block[-overlap:] if overlap else block[:0], new])
+
+def crossfade(n):
+    fade = np.sin(0.5 * np.pi * (np.arange(n) + 0.5) / max(n, 1)) ** 2
+    return fade.astype(np.float32), (1.0 - fade).astype(np.float32)
+
+def convert_file(pool, src, dst, pitch_shift=0, segment_s=10.0, overlap_s=0.5):
+    """Convert one file; at most 2 segments per worker are in flight."""
+    with sf.SoundFile(src) as f:
+        rate = f.samplerate
+        out_rate = pool.sample_rate
+        segment = max(1, int(segment_s * rate))
+        overlap = min(int(overlap_s * rate), segment)
+        overlap_out = int(round(overlap * out_rate / rate))
+        fade_in, fade_out = crossfade(overlap_out)
+        os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+        with sf.SoundFile(dst, "w", samplerate=out_rate, channels=1) as out:
+            pending = deque()
+            tail = None
+
+            def write_next():
+                nonlocal tail
+                future, n_in, last = pending.popleft()
+                n_out = int(round(n_in * out_rate / rate))
+                y = np.asarray(future.result(), dtype=np.float32)[:n_out]
+                if len(y) < n_out:
+                    y = np.pad(y, (0, n_out - len(y)))
+                if tail is not None:
+                    k = min(len(tail), len(y))
+                    y[:k] = y[:k] * fade_in[:k] + tail[:k] * fade_out[:k]
+                if last:
+                    out.write(y)
+                    tail = None
+                else:
+                    out.write(y[:len(y) - overlap_out])
+                    tail = y[len(y) - overlap_out:].copy()
+
+            for block, last in read_segments(f, segment, overlap):
+                pending.append((pool.submit(block, rate, pitch_shift), len(block), last))
+                while len(pending) > 2 * len(pool.backends):
+                    write_next()
+            while pending:
+                write_next()
+
+def collect_inputs(paths, output):
+    """(src, dst) pairs; directories are walked for WAV/FLAC files and mirrored under `output`."""
+    jobs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.lower().endswith(AUDIO_EXTENSIONS):
+                        src = os.path.join(root, name)
+                        jobs.append((src, os.path.join(output, os.path.relpath(src, path))))
+        elif len(paths) == 1 and output.lower().endswith(AUDIO_EXTENSIONS):
+            jobs.append((path, output))
+        else:
+            jobs.append((path, os.path.join(output, os.path.basename(path))))
+    return jobs
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline so-vits-svc batch conversion")
+    parser.add_argument("inputs", nargs="+", help="WAV/FLAC files or directories")
+    parser.add_argument("-o", "--output", required=True, help="output file (single input) or directory")
+    parser.add_argument("-s", "--infer-script", help="path to so-vits-svc inference_main.py")
+    parser.add_argument("-c", "--config", help="model config.json")
+    parser.add_argument("-m", "--model", help="model .pth")
+    parser.add_argument("--speaker", type=int, default=0)
+    parser.add_argument("-t", "--transpose", type=int, default=0, help="pitch shift in semitones")
+    parser.add_argument("--segment", type=float, default=10.0, help="segment length in seconds")
+    parser.add_argument("--overlap", type=float, default=0.5, help="crossfaded overlap in seconds")
+    parser.add_argument("-j", "--workers", type=int, default=2, help="resident model workers")
+    parser.add_argument("--fake", action="store_true", help="use the pass-through FakeBackend (testing)")
+    args = parser.parse_args(argv)
+
+    if args.fake:
+        factory = lambda: FakeBackend(args.speaker)
+    elif args.infer_script and args.config and args.model:
+        factory = lambda: SvcBackend(args.infer_script, args.config, args.model, args.speaker)
+    else:
+        parser.error("--infer-script, --config and --model are required unless --fake is given")
+
+    jobs = collect_inputs(args.inputs, args.output)
+    if not jobs:
+        parser.error("no WAV/FLAC inputs found")
+    pool = BackendPool(factory, args.workers)
+    failed = 0
+    try:
+        for src, dst in jobs:
+            try:
+                convert_file(pool, src, dst, args.transpose, args.segment, args.overlap)
+                print(f"{src} -> {dst}", file=sys.stderr)
+            except Exception as e:
+                failed += 1
+                print(f"{src}: {e}", file=sys.stderr)
+    finally:
+        pool.close()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
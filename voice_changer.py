@@ -1,47 +1,148 @@
 import sys
 import os
+import threading
 import numpy as np
 import sounddevice as sd
-import queue
-import tempfile
-import subprocess
-import soundfile as sf
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QPushButton, QLabel, QFileDialog, QSlider, QGroupBox, QFormLayout
+    QPushButton, QLabel, QFileDialog, QSlider, QGroupBox, QFormLayout, QSpinBox, QComboBox, QCheckBox
 )
 from PySide6.QtCore import Qt, QTimer
-from PySide6.QtGui import QPainter, QColor, QPen
+from PySide6.QtGui import QPainter, QColor, QPen, QPolygonF, QFont
+import shiboken6
+
+from voice_engine import ModelPool, DeadlineEngine
+from audio_pipeline import LivePipeline, SessionRecorder, VoiceActivityDetector, PitchShifter, StageStats
 
 # ----------- Sophisticated VoiceGraph Widget -------------
 class VoiceGraph(QWidget):
+    """
+    Waveform scope. The polyline is written straight from numpy into a
+    QPolygonF, min/max-decimated to the widget's pixel width, and only
+    rebuilt when the data or size changes.
+    submit() may be called from any thread; refresh() runs on the GUI thread.
+    """
+    SIZE = 1024
+    PEAK_DECAY = 0.95  # per update; keeps the scale stable between blocks
+
     def __init__(self):
         super().__init__()
-        self.data = np.zeros(1024)
+        self.data = np.zeros(self.SIZE)
+        self.peak = 0.0
+        self.polygon = QPolygonF()
+        self.dirty = True
+        self.pending = []
+        self.pending_lock = threading.Lock()
         self.setMinimumHeight(90)
 
+    def submit(self, data):
+        # Blocks are queued, not drawn: the GUI thread picks them up in refresh()
+        with self.pending_lock:
+            self.pending.append(data)
+            if len(self.pending) > 16:
+                del self.pending[0]
+
+    def refresh(self):
+        with self.pending_lock:
+            blocks, self.pending = self.pending, []
+        if blocks:
+            self.update_waveform(np.concatenate(blocks))
+
     def update_waveform(self, data):
-        if len(data) >= 1024:
-            self.data = data[-1024:]
+        data = np.asarray(data, dtype=np.float64)
+        n = min(len(data), self.SIZE)
+        if n:
+            self.data[:-n] = self.data[n:]
+            self.data[-n:] = data[-n:]
+            block_peak = np.abs(data[-n:]).max()
         else:
-            self.data = np.pad(data, (1024 - len(data), 0))
+            block_peak = 0.0
+        self.peak = max(block_peak, self.peak * self.PEAK_DECAY)
+        if self.peak < 1e-9:
+            self.peak = 0.0
+        self.dirty = True
         self.update()
 
+    def clear(self):
+        self.data[:] = 0
+        self.peak = 0.0
+        self.dirty = True
+        self.update()
+
+    def resizeEvent(self, event):
+        self.dirty = True
+        super().resizeEvent(event)
+
+    def build_polygon(self, w, h):
+        if w * 2 < len(self.data):
+            # One min and one max per pixel column keeps every peak visible; the
+            # remainder is dropped from the oldest end so the right edge stays current
+            cols = self.data[len(self.data) % w:].reshape(w, -1)
+            ys = np.empty(2 * w)
+            ys[0::2] = cols.min(axis=1)
+            ys[1::2] = cols.max(axis=1)
+            xs = np.repeat(np.arange(w, dtype=np.float64), 2)
+        else:
+            ys = self.data
+            xs = np.linspace(0, w, len(ys))
+        n = len(ys)
+        if self.polygon.size() != n:
+            self.polygon.resize(n)
+        pts = np.frombuffer(shiboken6.VoidPtr(self.polygon.data(), n * 16, True), dtype=np.float64).reshape(n, 2)
+        pts[:, 0] = xs
+        np.multiply(ys, -h / 2 / self.peak, out=pts[:, 1])
+        pts[:, 1] += h / 2
+
     def paintEvent(self, event):
         painter = QPainter(self)
         painter.fillRect(self.rect(), QColor(30, 30, 30))
         w, h = self.width(), self.height()
-        pen = QPen(QColor(0, 255, 100), 2)
-        painter.setPen(pen)
-        if self.data is not None and np.max(np.abs(self.data)) > 0:
-            x = np.linspace(0, w, len(self.data))
-            y = h / 2 - self.data / np.max(np.abs(self.data)) * h / 2
-            points = [Qt.QPointF(x[i], y[i]) for i in range(len(x))]
-            painter.drawPolyline(*points)
+        if self.peak <= 0 or w <= 0:
+            return
+        if self.dirty:
+            self.build_polygon(w, h)
+            self.dirty = False
+        painter.setPen(QPen(QColor(0, 255, 100), 2))
+        painter.drawPolyline(self.polygon)
+
+class StatsHistogram(QWidget):
+    """Bar chart of one StageStats histogram, trimmed to its occupied bins."""
+    def __init__(self):
+        super().__init__()
+        self.counts = np.zeros(StageStats.BINS, dtype=np.int64)
+        self.setMinimumHeight(70)
+
+    def set_counts(self, counts):
+        if not np.array_equal(counts, self.counts):
+            self.counts = counts.copy()
+            self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(30, 30, 30))
+        used = np.flatnonzero(self.counts)
+        if not len(used):
+            return
+        lo, hi = used[0], used[-1] + 1
+        counts = self.counts[lo:hi]
+        w, h = self.width(), self.height() - 14
+        bar = w / len(counts)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(0, 180, 255))
+        scale = h / counts.max()
+        for i, c in enumerate(counts):
+            painter.drawRect(int(i * bar), int(h - c * scale), max(1, int(bar) - 1), int(c * scale))
+        painter.setPen(QColor(200, 200, 200))
+        painter.drawText(2, self.height() - 2, f"{StageStats.edge(lo) * 1000:.3g} ms")
+        right = f"{StageStats.edge(hi) * 1000:.3g} ms"
+        painter.drawText(w - painter.fontMetrics().horizontalAdvance(right) - 2, self.height() - 2, right)
+
+# Share of a pipeline hop the model may take before the built-in shifter covers the window
+DEADLINE_FRACTION = 0.75
 
 # ----------- Main Voice Changer GUI ----------------------
 class VoiceChanger(QMainWindow):
-    def __init__(self):
+    def __init__(self, backend=None):
         super().__init__()
         self.setWindowTitle("AI Voice Changer (so-vits-svc powered)")
         self.setMinimumSize(950, 700)
@@ -52,17 +153,44 @@ class VoiceChanger(QMainWindow):
         self.transformed_audio = np.zeros(1024)
         self.modified_audio = np.zeros(1024)
         self.stream = None
+        self.pipeline = None
+        self.recorder = None   # whole-session input/output recording, spilled to disk
+        self.player = None
+        # Sound card rate, and the rate windows are fed to the model at
+        self.device_rate = 16000
+        self.model_rate = 16000
+        # Real-time pipeline tuning: bigger windows/lookahead = better quality, more latency
+        self.window_ms = 256
+        self.overlap_pct = 50
+        self.crossfade_ms = 32
+        self.lookahead_ms = 32
+        # Voice activity gate: silent windows skip the model
+        self.gate_enabled = True
+        self.gate_threshold_db = 9
+        self.gate_hangover_ms = 300
+        self.gate_preroll_ms = 64  # at most lookahead + crossfade
+        self.gate_mode = "passthrough"
 
         # so-vits-svc model config (!!! SET THESE BEFORE USE !!!)
         self.SVC_INFER_SCRIPT = "/home/ntb/so-vits-svc/inference_main.py" # path to so-vits-svc inference_main.py
         self.CONFIG_PATH = "/path/to/config.json"                       # path to model config.json
         self.MODEL_PATH = "/path/to/model.pth"                          # path to model .pth
         self.SPEAKER_ID = 0                                             # set the correct speaker id for your model
+        # Resident models for every registered voice, LRU-evicted under a memory budget
+        self.pool_budget_mb = 4096
+        self.pool = ModelPool(self.pool_budget_mb)
+        if backend is not None:  # e.g. a FakeBackend for tests
+            self.pool.add_backend("default", backend)
+        # "dsp": built-in pitch shifter; "model": so-vits-svc, falling back to the shifter on a missed deadline
+        self.engine = "dsp"
+        self.shifter = PitchShifter()
+        self.model_engine = DeadlineEngine(self.pool, self.shift_pitch)
 
         self.init_ui()
         self.timer = QTimer()
         self.timer.timeout.connect(self.refresh_graphs)
         self.timer.start(30)
+        self.stats_ticks = 0
 
     def init_ui(self):
         main = QWidget()
@@ -71,7 +199,7 @@ class VoiceChanger(QMainWindow):
         # Top: Target voice upload
         row = QHBoxLayout()
         self.target_file_label = QLabel("No target loaded")
-        load_btn = QPushButton("Load Target Voice (for speaker id)")
+        load_btn = QPushButton("Load Target Voice (model .pth)")
         load_btn.clicked.connect(self.load_target_voice)
         row.addWidget(load_btn)
         row.addWidget(self.target_file_label)
@@ -104,19 +232,111 @@ class VoiceChanger(QMainWindow):
         self.pitch_slider.setValue(0)
         self.pitch_slider.valueChanged.connect(self.change_pitch)
         controls_layout.addRow("Pitch Shift (semitones)", self.pitch_slider)
+        self.engine_box = QComboBox()
+        self.engine_box.addItem("Built-in Pitch Shifter", "dsp")
+        self.engine_box.addItem("so-vits-svc Model", "model")
+        self.engine_box.currentIndexChanged.connect(self.change_engine)
+        controls_layout.addRow("Engine", self.engine_box)
+        self.formant_check = QCheckBox("Preserve formants")
+        self.formant_check.setChecked(self.shifter.preserve_formants)
+        self.formant_check.toggled.connect(self.change_formants)
+        self.formant_slider = QSlider(Qt.Horizontal)
+        self.formant_slider.setRange(-12, 12)
+        self.formant_slider.setValue(0)
+        self.formant_slider.valueChanged.connect(self.change_formants)
+        controls_layout.addRow(self.formant_check)
+        controls_layout.addRow("Formant Shift (semitones)", self.formant_slider)
+        self.fallback_label = QLabel("")
+        controls_layout.addRow("Model Fallbacks", self.fallback_label)
         controls.setLayout(controls_layout)
         layout.addWidget(controls)
 
-        # --- Multi-speaker (Placeholder) ---
+        # --- Latency / Quality ---
+        rt_box = QGroupBox("Latency / Quality")
+        rt_layout = QFormLayout()
+        self.window_spin = self.make_spin(64, 2048, self.window_ms, " ms")
+        self.overlap_spin = self.make_spin(0, 90, self.overlap_pct, " %")
+        self.crossfade_spin = self.make_spin(0, 500, self.crossfade_ms, " ms")
+        self.lookahead_spin = self.make_spin(0, 500, self.lookahead_ms, " ms")
+        rt_layout.addRow("Analysis Window", self.window_spin)
+        rt_layout.addRow("Overlap", self.overlap_spin)
+        rt_layout.addRow("Crossfade", self.crossfade_spin)
+        rt_layout.addRow("Lookahead", self.lookahead_spin)
+        self.device_rate_box = self.make_rate_box(self.device_rate)
+        self.model_rate_box = self.make_rate_box(self.model_rate)
+        rt_layout.addRow("Device Sample Rate", self.device_rate_box)
+        rt_layout.addRow("Model Sample Rate", self.model_rate_box)
+        self.latency_label = QLabel("")
+        rt_layout.addRow("Algorithmic Latency", self.latency_label)
+        rt_box.setLayout(rt_layout)
+        layout.addWidget(rt_box)
+
+        # --- Voice Activity Gate ---
+        gate_box = QGroupBox("Voice Activity Gate")
+        gate_layout = QFormLayout()
+        self.gate_check = QCheckBox("Skip inference on silence")
+        self.gate_check.setChecked(self.gate_enabled)
+        self.gate_check.toggled.connect(self.update_gate)
+        self.gate_mode_box = QComboBox()
+        for mode in ("passthrough", "noise", "silence"):
+            self.gate_mode_box.addItem(mode.capitalize(), mode)
+        self.gate_mode_box.currentIndexChanged.connect(self.update_gate)
+        self.gate_threshold_spin = self.make_spin(3, 30, self.gate_threshold_db, " dB", self.update_gate)
+        self.gate_hangover_spin = self.make_spin(0, 2000, self.gate_hangover_ms, " ms", self.update_gate)
+        self.gate_preroll_spin = self.make_spin(0, 500, self.gate_preroll_ms, " ms", self.update_gate)
+        self.gate_preroll_spin.setToolTip("Upcoming audio checked for speech, so the gate opens before a word;\n"
+                                          "limited to Lookahead + Crossfade")
+        self.gate_stats_label = QLabel("Converted: 0   Gated: 0")
+        gate_layout.addRow(self.gate_check)
+        gate_layout.addRow("Silent Windows", self.gate_mode_box)
+        gate_layout.addRow("Threshold Above Noise", self.gate_threshold_spin)
+        gate_layout.addRow("Hangover", self.gate_hangover_spin)
+        gate_layout.addRow("Pre-roll", self.gate_preroll_spin)
+        gate_layout.addRow("Windows", self.gate_stats_label)
+        gate_box.setLayout(gate_layout)
+        layout.addWidget(gate_box)
+        self.update_pipeline_params()
+
+        # --- Multi-speaker ---
         ms_box = QGroupBox("Multi-Speaker Management")
         ms_layout = QHBoxLayout()
-        for s in range(1, 3):
-            btn = QPushButton(f"Speaker {s}")
-            btn.setEnabled(False)
-            ms_layout.addWidget(btn)
+        self.voice_box = QComboBox()
+        self.voice_box.addItems(list(self.pool.voices))
+        self.voice_box.activated.connect(self.switch_voice)
+        self.budget_spin = self.make_spin(256, 65536, self.pool_budget_mb, " MB", self.update_pool_budget)
+        self.budget_spin.setSingleStep(256)
+        preload_btn = QPushButton("Preload All")
+        preload_btn.clicked.connect(self.preload_voices)
+        self.pool_label = QLabel("")
+        ms_layout.addWidget(QLabel("Voice"))
+        ms_layout.addWidget(self.voice_box)
+        ms_layout.addWidget(QLabel("Memory Budget"))
+        ms_layout.addWidget(self.budget_spin)
+        ms_layout.addWidget(preload_btn)
+        ms_layout.addWidget(self.pool_label)
         ms_box.setLayout(ms_layout)
         layout.addWidget(ms_box)
 
+        # --- Pipeline stats ---
+        stats_box = QGroupBox("Pipeline Stats")
+        stats_layout = QHBoxLayout()
+        hist_col = QVBoxLayout()
+        self.stage_box = QComboBox()
+        self.stage_box.addItems(list(self.pipeline.stats.STAGES))
+        self.stage_box.setCurrentText("inference")
+        self.stats_hist = StatsHistogram()
+        hist_col.addWidget(self.stage_box)
+        hist_col.addWidget(self.stats_hist)
+        self.stats_label = QLabel("")
+        self.stats_label.setFont(QFont("monospace", 8))
+        self.counters_label = QLabel("")
+        self.counters_label.setWordWrap(True)
+        stats_layout.addLayout(hist_col, 1)
+        stats_layout.addWidget(self.stats_label, 2)
+        stats_layout.addWidget(self.counters_label, 1)
+        stats_box.setLayout(stats_layout)
+        layout.addWidget(stats_box)
+
         # --- LIVE mode, Export, Operation Bar ---
         bottom_row = QHBoxLayout()
         self.live_btn = QPushButton("Start LIVE Mode")
@@ -143,96 +363,268 @@ class VoiceChanger(QMainWindow):
         self.setCentralWidget(main)
 
     def load_target_voice(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, "Choose Target Voice", "", "Audio files (*.wav *.mp3 *.flac)")
-        if file_path:
-            self.target_file_label.setText(file_path.split("/")[-1])
-            self.target_voice_path = file_path
-            # For so-vits-svc, set self.SPEAKER_ID accordingly if your model is multi-speaker
+        # Registers every speaker of the model in the pool and preloads it if it fits the budget
+        file_path, _ = QFileDialog.getOpenFileName(self, "Choose Target Voice Model", "", "so-vits-svc model (*.pth)")
+        if not file_path:
+            return
+        config_path = os.path.join(os.path.dirname(file_path), "config.json")
+        if not os.path.exists(config_path):
+            config_path, _ = QFileDialog.getOpenFileName(self, "Choose Model Config", os.path.dirname(file_path), "Config (*.json)")
+            if not config_path:
+                return
+        try:
+            names = self.pool.add_svc(self.SVC_INFER_SCRIPT, config_path, file_path)
+        except Exception as e:
+            self.pool.note_error(f"target voice: {e!r}")
+            return
+        self.target_voice_path = file_path
+        self.target_file_label.setText(os.path.basename(file_path))
+        for name in names:
+            if self.voice_box.findText(name) < 0:
+                self.voice_box.addItem(name)
+        if self.pool.active is None:
+            self.voice_box.setCurrentText(names[0])
+        threading.Thread(target=self.pool.preload, args=(names,), daemon=True).start()
+
+    def switch_voice(self, *_):
+        # The model loads off the GUI thread; the old voice keeps converting until it is ready
+        name = self.voice_box.currentText()
+        if name:
+            threading.Thread(target=self.activate_voice, args=(name,), daemon=True).start()
+
+    def activate_voice(self, name):
+        try:
+            self.pool.activate(name)
+        except Exception as e:
+            self.pool.note_error(f"model load: {e!r}")
+
+    def preload_voices(self):
+        threading.Thread(target=self.pool.preload, daemon=True).start()
+
+    def update_pool_budget(self, value):
+        self.pool_budget_mb = value
+        threading.Thread(target=self.pool.set_budget, args=(value,), daemon=True).start()
 
     def change_pitch(self, value):
         self.pitch_shift = value
 
+    def change_engine(self, *_):
+        self.engine = self.engine_box.currentData()
+        if self.engine == "model" and self.running:
+            self.ensure_backend()
+
+    def change_formants(self, *_):
+        self.shifter.preserve_formants = self.formant_check.isChecked()
+        self.shifter.formant_shift = self.formant_slider.value()
+
+    def make_spin(self, lo, hi, value, suffix, slot=None):
+        spin = QSpinBox()
+        spin.setRange(lo, hi)
+        spin.setValue(value)
+        spin.setSuffix(suffix)
+        spin.valueChanged.connect(slot or self.update_pipeline_params)
+        return spin
+
+    def update_gate(self, *_):
+        self.gate_enabled = self.gate_check.isChecked()
+        self.gate_mode = self.gate_mode_box.currentData()
+        self.gate_threshold_db = self.gate_threshold_spin.value()
+        self.gate_hangover_ms = self.gate_hangover_spin.value()
+        self.gate_preroll_ms = self.gate_preroll_spin.value()
+        vad = self.pipeline.vad
+        if not self.gate_enabled:
+            self.pipeline.vad = None
+        elif vad is None or vad.samplerate != self.model_rate:
+            self.pipeline.vad = VoiceActivityDetector(
+                self.model_rate, threshold_db=self.gate_threshold_db, hangover_ms=self.gate_hangover_ms)
+        else:
+            # Keep the tracked noise floor and hangover state; only the knobs change
+            vad.threshold_db = self.gate_threshold_db
+            vad.hangover = int(self.model_rate * self.gate_hangover_ms / 1000)
+            vad.hang_left = min(vad.hang_left, vad.hangover)
+        self.pipeline.gate_mode = self.gate_mode
+        self.pipeline.preroll = int(self.gate_preroll_ms * self.model_rate / 1000)
+
+    def make_rate_box(self, value):
+        box = QComboBox()
+        for rate in (16000, 22050, 32000, 44100, 48000):
+            box.addItem(f"{rate} Hz", rate)
+        box.setCurrentIndex(box.findData(value))
+        box.currentIndexChanged.connect(self.update_pipeline_params)
+        return box
+
+    def pipeline_params(self):
+        ms = self.model_rate / 1000
+        return dict(
+            window=int(self.window_ms * ms),
+            overlap=self.overlap_pct / 100,
+            crossfade=int(self.crossfade_ms * ms),
+            lookahead=int(self.lookahead_ms * ms),
+        )
+
+    def update_pipeline_params(self, *_):
+        self.window_ms = self.window_spin.value()
+        self.overlap_pct = self.overlap_spin.value()
+        self.crossfade_ms = self.crossfade_spin.value()
+        self.lookahead_ms = self.lookahead_spin.value()
+        self.device_rate = self.device_rate_box.currentData()
+        self.model_rate = self.model_rate_box.currentData()
+        if self.pipeline is None:
+            self.pipeline = LivePipeline(self.convert_window, monitor=self.monitor_block, samplerate=self.model_rate,
+                                         device_rate=self.device_rate, **self.pipeline_params())
+        else:
+            if not self.pipeline.running:
+                self.pipeline.set_rates(self.model_rate, self.device_rate)
+            self.pipeline.configure(**self.pipeline_params())
+        hop = (self.pipeline.pending or self.pipeline.params)["hop"]
+        self.model_engine.deadline = DEADLINE_FRACTION * hop / self.model_rate
+        self.latency_label.setText(f"{self.pipeline.latency_ms():.0f} ms")
+        if hasattr(self, "gate_check"):
+            # Pre-roll only sees the part of the window past the emitted hop
+            p = self.pipeline.pending or self.pipeline.params
+            self.gate_preroll_spin.setMaximum(int((p["lookahead"] + p["crossfade"]) * 1000 / self.model_rate))
+            self.update_gate()
+
     def toggle_live_mode(self):
         if self.live_btn.isChecked():
             self.live_btn.setText("Stop LIVE Mode")
             self.running = True
+            self.device_rate_box.setEnabled(False)
+            self.model_rate_box.setEnabled(False)
             self.start_live_audio()
         else:
             self.live_btn.setText("Start LIVE Mode")
             self.running = False
+            self.device_rate_box.setEnabled(True)
+            self.model_rate_box.setEnabled(True)
             if self.stream: self.stream.stop()
+            self.pipeline.stop()
+            self.pipeline.recorder = None
+            if self.recorder:
+                self.recorder.stop()
+
+    def ensure_backend(self):
+        # The model loads in the background; the built-in shifter covers LIVE mode until it is ready
+        if self.pool.active is not None:
+            return
+        try:
+            if not self.pool.voices:
+                for name in self.pool.add_svc(self.SVC_INFER_SCRIPT, self.CONFIG_PATH, self.MODEL_PATH):
+                    self.voice_box.addItem(name)
+                self.voice_box.setCurrentIndex(min(self.SPEAKER_ID, self.voice_box.count() - 1))
+        except Exception as e:
+            self.pool.note_error(f"model load: {e!r}")
+            return
+        self.switch_voice()
 
     def start_live_audio(self):
-        def callback(indata, outdata, frames, time, status):
-            if not self.running:
-                outdata[:] = np.zeros_like(indata)
-                return
-            self.input_audio = indata[:, 0]
-            self.mod_graph.update_waveform(self.input_audio)
-            transformed = self.transform_voice(self.input_audio, self.pitch_shift)
-            outdata[:, 0] = transformed[:len(outdata)]
-            self.transformed_audio = transformed
-            self.tr_graph.update_waveform(self.transformed_audio)
-            self.in_graph.update_waveform(self.input_audio)
-        self.stream = sd.Stream(channels=1, samplerate=16000, blocksize=1024, callback=callback)
+        # The sd.Stream callback only moves samples through the pipeline's ring
+        # buffers; conversion runs on the pipeline's worker thread.
+        if self.engine == "model":
+            self.ensure_backend()
+        if self.recorder:
+            self.recorder.close()
+        self.recorder = SessionRecorder(self.device_rate)
+        self.pipeline.recorder = self.recorder
+        self.pipeline.start()
+        self.stream = sd.Stream(channels=1, samplerate=self.device_rate, blocksize=1024, callback=self.pipeline.callback)
         self.stream.start()
 
+    def convert_window(self, x):
+        return self.transform_voice(x, self.pitch_shift)
+
+    def monitor_block(self, x, y):
+        # Called on the pipeline worker thread; graphs are only handed the data
+        self.input_audio = x
+        self.transformed_audio = y
+        self.in_graph.submit(x)
+        self.mod_graph.submit(x)
+        self.tr_graph.submit(y)
+
     def transform_voice(self, x, pitch_shift):
         """
-        True so-vits-svc inference: 
-        Save the input as WAV, call so-vits-svc inference_main.py, load result.
+        Built-in pitch shifter, or so-vits-svc inference with the pool's
+        active voice (model stays loaded, blocks passed in memory) that falls
+        back to the shifter for windows it cannot finish in time.
         """
-        # Save input to temp WAV file
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp_in:
-            sf.write(tmp_in.name, x, 16000)
-            input_path = tmp_in.name
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp_out:
-            output_path = tmp_out.name
-
-        # Compose the so-vits-svc inference command
-        command = [
-            sys.executable, self.SVC_INFER_SCRIPT,
-            "-c", self.CONFIG_PATH,
-            "-m", self.MODEL_PATH,
-            "-n", input_path,
-            "-o", output_path,
-            "-spk", str(self.SPEAKER_ID),
-            "--transpose", str(pitch_shift)
-        ]
-        try:
-            subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            y, sr = sf.read(output_path)
-            if sr != 16000:
-                import librosa
-                y = librosa.resample(y, orig_sr=sr, target_sr=16000)
-            # Clean up temp files
-            os.remove(input_path)
-            os.remove(output_path)
-            return y[:1024] if len(y) > 1024 else np.pad(y, (0, 1024 - len(y)))
-        except Exception as e:
-            print("Voice conversion error:", e)
-            return np.zeros(1024)
+        if self.engine == "model":
+            y = self.model_engine.convert(x, self.model_rate, pitch_shift)
+        else:
+            y = self.shift_pitch(x, self.model_rate, pitch_shift)
+        return y[:len(x)] if len(y) > len(x) else np.pad(y, (0, len(x) - len(y)))
+
+    def shift_pitch(self, x, samplerate, pitch_shift):
+        return self.shifter.shift(x, samplerate, pitch_shift)
 
     def refresh_graphs(self):
-        self.in_graph.update_waveform(self.input_audio)
-        self.tr_graph.update_waveform(self.transformed_audio)
-        self.mod_graph.update_waveform(self.input_audio)
+        self.in_graph.refresh()
+        self.tr_graph.refresh()
+        self.mod_graph.refresh()
+        self.gate_stats_label.setText(f"Converted: {self.pipeline.converted}   Gated: {self.pipeline.gated}")
+        self.fallback_label.setText(f"{self.model_engine.fallbacks} windows ({self.model_engine.misses} past deadline)")
+        self.pool_label.setText(
+            f"Active: {self.pool.active or '-'}   Loaded: {len(self.pool.loaded_models())} "
+            f"({self.pool.used() / 2**20:.0f} MB)")
+        self.stats_ticks += 1
+        if self.stats_ticks % 15 == 0:  # about twice a second
+            self.refresh_stats()
+
+    def refresh_stats(self):
+        p = self.pipeline
+        self.stats_hist.set_counts(p.stats[self.stage_box.currentText()].counts)
+        lines = [f"{'stage':<10}{'n':>7}{'p50':>9}{'p99':>9}{'max':>9}  ms"]
+        for name, (n, _, p50, p99, worst) in p.stats.summary().items():
+            lines.append(f"{name:<10}{n:>7}{p50 * 1000:>9.2f}{p99 * 1000:>9.2f}{worst * 1000:>9.2f}")
+        self.stats_label.setText("\n".join(lines))
+        stream_latency = sum(self.stream.latency) if self.running and self.stream else 0.0
+        error = p.last_error or self.model_engine.last_error or self.pool.last_error
+        self.counters_label.setText(
+            f"End-to-end: {p.end_to_end_ms(stream_latency):.0f} ms\n"
+            f"Xruns: {p.xruns}   Underruns: {p.underruns}   Overruns: {p.inbuf.overruns}\n"
+            f"Deadline misses: {p.deadline_misses} (model: {self.model_engine.misses})\n"
+            f"Recording gaps: {self.recorder.dropped if self.recorder else 0} (blocks cut short by disk stalls)\n"
+            f"Errors: {p.errors + self.model_engine.errors} (models: {self.pool.errors})"
+            + (f"\nLast: {error}" if error else ""))
 
     def play_last_audio(self):
-        sd.play(self.transformed_audio, samplerate=16000)
+        # Streams the recorded session from its spill file
+        if not self.recorder:
+            return
+        if self.player:
+            self.player.stop()
+        self.player = sd.OutputStream(channels=1, samplerate=self.recorder.samplerate, callback=self.recorder.player(sd.CallbackStop))
+        self.player.start()
 
     def export_audio(self):
+        if not self.recorder:
+            return
         fname, _ = QFileDialog.getSaveFileName(self, "Save transformed", "", "WAV (*.wav)")
         if fname:
-            sf.write(fname, self.transformed_audio, 16000)
-            print(f"Saved: {fname}")
+            self.recorder.export(fname)
+            self.statusBar().showMessage(f"Saved: {fname} ({self.recorder.duration():.1f} s)", 5000)
+
+    def closeEvent(self, event):
+        self.running = False
+        if self.stream:
+            self.stream.stop()
+        self.pipeline.stop()
+        if self.player:
+            self.player.stop()
+        if self.recorder:
+            self.recorder.close()
+        self.model_engine.close()
+        self.pool.close()
+        event.accept()
 
     def clear_audio(self):
+        if self.recorder and not self.running:
+            self.recorder.close()
+            self.recorder = None
         self.input_audio = np.zeros(1024)
         self.transformed_audio = np.zeros(1024)
-        self.mod_graph.update_waveform(self.input_audio)
-        self.in_graph.update_waveform(self.input_audio)
-        self.tr_graph.update_waveform(self.input_audio)
+        self.mod_graph.clear()
+        self.in_graph.clear()
+        self.tr_graph.clear()
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -0,0 +1,390 @@
+import io
+import json
+import os
+import sys
+import threading
+import time
+import multiprocessing as mp
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import numpy as np
+import soundfile as sf
+
+from audio_pipeline import resample
+
+# Per-process cost of an SvcBackend on top of its .pth (content encoder, torch runtime)
+SVC_PROCESS_OVERHEAD = 512 << 20
+
+# ----------- Inference backends -------------
+class InferenceBackend:
+    """
+    Resident voice conversion model.
+    load() is called once; convert() takes a mono float32 block at
+    input_rate and returns the converted block at self.sample_rate.
+    Multi-speaker models take a per-call speaker_id (default: the
+    backend's own).
+    """
+    sample_rate = 16000
+
+    def __init__(self, speaker_id=0):
+        self.speaker_id = speaker_id
+        self.loaded = False
+
+    def load(self):
+        self.loaded = True
+
+    def convert(self, x, input_rate, pitch_shift, speaker_id=None):
+        raise NotImplementedError
+
+    def close(self):
+        self.loaded = False
+
+
+class FakeBackend(InferenceBackend):
+    """
+    Stand-in model for tests and benchmarks: applies a gain and can
+    simulate inference latency, without touching torch or so-vits-svc.
+    """
+    def __init__(self, speaker_id=0, sample_rate=16000, gain=1.0, latency=0.0):
+        super().__init__(speaker_id)
+        self.sample_rate = sample_rate
+        self.gain = gain
+        self.latency = latency
+        self.calls = 0
+
+    def convert(self, x, input_rate, pitch_shift, speaker_id=None):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        y = np.asarray(x, dtype=np.float32) * self.gain
+        if input_rate != self.sample_rate:
+            n = int(round(len(y) * self.sample_rate / input_rate))
+            y = np.interp(np.linspace(0, len(y) - 1, n), np.arange(len(y)), y).astype(np.float32)
+        return y
+
+
+def svc_worker(conn, svc_root, model_path, config_path):
+    # Runs in the long-lived worker process: so-vits-svc resolves its pretrained
+    # encoders relative to its own checkout, so the worker lives there.
+    try:
+        os.chdir(svc_root)
+        sys.path.insert(0, svc_root)
+        from inference.infer_tool import Svc
+        svc = Svc(model_path, config_path)
+    except Exception as e:
+        conn.send(("error", repr(e)))
+        return
+    conn.send(("ready", svc.target_sample))
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        x, input_rate, speaker_id, pitch_shift = request
+        try:
+            wav = io.BytesIO()
+            sf.write(wav, x, input_rate, format="WAV", subtype="FLOAT")
+            wav.seek(0)
+            y = svc.infer(speaker_id, pitch_shift, wav)[0]
+            if hasattr(y, "cpu"):
+                y = y.cpu().numpy()
+            conn.send(("ok", np.asarray(y, dtype=np.float32)))
+        except Exception as e:
+            conn.send(("error", repr(e)))
+
+
+class SvcBackend(InferenceBackend):
+    """
+    so-vits-svc model kept resident in one worker process.
+    Config and .pth are loaded once; blocks travel over a pipe in memory.
+    """
+    def __init__(self, infer_script, config_path, model_path, speaker_id=0):
+        super().__init__(speaker_id)
+        self.svc_root = os.path.dirname(os.path.abspath(infer_script))
+        self.config_path = os.path.abspath(config_path)
+        self.model_path = os.path.abspath(model_path)
+        self.lock = threading.Lock()
+        self.conn = None
+        self.proc = None
+
+    def load(self):
+        if self.loaded:
+            return
+        ctx = mp.get_context("spawn")
+        self.conn, child = ctx.Pipe()
+        self.proc = ctx.Process(
+            target=svc_worker,
+            args=(child, self.svc_root, self.model_path, self.config_path),
+            daemon=True,
+        )
+        self.proc.start()
+        child.close()
+        status, value = self.conn.recv()
+        if status != "ready":
+            self.close()
+            raise RuntimeError(f"so-vits-svc failed to load: {value}")
+        self.sample_rate = value
+        self.loaded = True
+
+    def convert(self, x, input_rate, pitch_shift, speaker_id=None):
+        if speaker_id is None:
+            speaker_id = self.speaker_id
+        with self.lock:
+            self.conn.send((np.asarray(x, dtype=np.float32), input_rate, speaker_id, pitch_shift))
+            status, value = self.conn.recv()
+        if status != "ok":
+            raise RuntimeError(value)
+        return value
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            self.conn.close()
+            self.conn = None
+        if self.proc is not None:
+            self.proc.join(timeout=2)
+            if self.proc.is_alive():
+                self.proc.terminate()
+            self.proc = None
+        self.loaded = False
+
+
+def svc_speakers(config_path):
+    """Speaker name -> id from a so-vits-svc config.json ("spk" map)."""
+    with open(config_path, encoding="utf-8") as f:
+        speakers = json.load(f).get("spk") or {}
+    return {str(name): int(sid) for name, sid in speakers.items()} or {"0": 0}
+
+# ----------- Multi-speaker model pool -------------
+class PoolEntry:
+    def __init__(self, factory, size):
+        self.factory = factory
+        self.size = size
+        self.backend = None
+        self.busy = 0                     # convert() calls currently using the backend
+        self.load_lock = threading.Lock()
+
+
+class ModelPool:
+    """
+    Resident backends for several voices under a memory budget.
+    A voice is one speaker of one model; speakers of a model share its
+    backend, so switching between them is free. Models load on demand or
+    are preloaded in the background; when the budget would be exceeded the
+    least recently used idle models are closed first.
+
+    The active voice only changes once its model is loaded, so a switch
+    during LIVE mode never stalls the pipeline: the old voice keeps
+    converting until the new one is ready, and the pipeline crossfade
+    covers the seam. Unlike a single backend, convert() returns audio at
+    input_rate, since consecutive calls may go to models with different
+    rates.
+
+    Failures to preload or unload a model are counted in `errors` with the
+    latest in `last_error`. A model bigger than the whole budget is refused;
+    switching voices may overshoot the budget until the switch completes,
+    since the active model cannot be evicted while it is still converting.
+    """
+    def __init__(self, budget_mb=4096):
+        self.budget = budget_mb << 20
+        self.lock = threading.Lock()
+        self.models = OrderedDict()  # model key -> PoolEntry, least recently used first
+        self.voices = {}             # voice name -> (model key, speaker id)
+        self.active = None
+        self.errors = 0
+        self.last_error = None
+
+    def note_error(self, message):
+        self.errors += 1
+        self.last_error = message
+
+    def add_model(self, key, factory, size=0):
+        with self.lock:
+            if key not in self.models:
+                self.models[key] = PoolEntry(factory, size)
+
+    def add_voice(self, name, key, speaker_id=0):
+        with self.lock:
+            self.voices[name] = (key, speaker_id)
+
+    def add_backend(self, name, backend, size=0):
+        """Register an already constructed backend as a single voice."""
+        self.add_model(name, lambda: backend, size)
+        self.add_voice(name, name, backend.speaker_id)
+        return [name]
+
+    def add_svc(self, infer_script, config_path, model_path):
+        """Register every speaker of a so-vits-svc model; returns the new voice names."""
+        key = os.path.abspath(model_path)
+        model = os.path.splitext(os.path.basename(model_path))[0]
+        speakers = svc_speakers(config_path)
+        self.add_model(
+            key,
+            lambda: SvcBackend(infer_script, config_path, model_path),
+            os.path.getsize(model_path) + SVC_PROCESS_OVERHEAD,
+        )
+        names = []
+        for speaker, sid in speakers.items():
+            name = model if len(speakers) == 1 else f"{model}/{speaker}"
+            self.add_voice(name, key, sid)
+            names.append(name)
+        return names
+
+    def set_budget(self, budget_mb):
+        with self.lock:
+            self.budget = budget_mb << 20
+            victims = self.evict_locked(0)
+            self.check_budget_locked()
+        self.close_all(victims)
+
+    def used_locked(self):
+        return sum(e.size for e in self.models.values() if e.backend is not None)
+
+    def used(self):
+        with self.lock:
+            return self.used_locked()
+
+    def loaded_models(self):
+        with self.lock:
+            return [key for key, e in self.models.items() if e.backend is not None]
+
+    def evict_locked(self, need, keep=None):
+        # Caller holds self.lock. Detaches LRU idle backends until `need`
+        # more bytes fit; they are closed outside the lock.
+        active = self.voices[self.active][0] if self.active else None
+        used = self.used_locked()
+        victims = []
+        for key, e in self.models.items():
+            if used + need <= self.budget:
+                break
+            if e.backend is None or e.busy or key in (keep, active):
+                continue
+            victims.append(e.backend)
+            e.backend = None
+            used -= e.size
+        return victims
+
+    def check_budget_locked(self):
+        # Caller holds self.lock, after evicting: only busy or active models are left over budget
+        used = self.used_locked()
+        if used > self.budget:
+            self.note_error(f"over budget: {used >> 20} MB resident, {self.budget >> 20} MB allowed")
+
+    def close_all(self, backends):
+        for backend in backends:
+            try:
+                backend.close()
+            except Exception as e:
+                self.note_error(f"unload: {e!r}")
+
+    def load(self, key, evict=True):
+        """Make a model resident; False if it does not fit and evict is off."""
+        entry = self.models[key]
+        with entry.load_lock:
+            with self.lock:
+                if entry.backend is not None:
+                    self.models.move_to_end(key)
+                    return True
+                if not evict and self.used_locked() + entry.size > self.budget:
+                    return False
+                if entry.size > self.budget:
+                    self.note_error(f"{os.path.basename(key)} needs {entry.size >> 20} MB, "
+                                    f"over the {self.budget >> 20} MB budget")
+                    return False
+                victims = self.evict_locked(entry.size, keep=key)
+            self.close_all(victims)
+            backend = entry.factory()
+            backend.load()
+            with self.lock:
+                entry.backend = backend
+                self.models.move_to_end(key)
+        return True
+
+    def preload(self, names=None):
+        """Load the given voices' models (default: all) while they fit the budget."""
+        for name in names if names is not None else list(self.voices):
+            try:
+                self.load(self.voices[name][0], evict=False)
+            except Exception as e:
+                self.note_error(f"preload {name}: {e!r}")
+
+    def activate(self, name):
+        """Switch to a voice; blocks while its model loads, then swaps atomically."""
+        key = self.voices[name][0]
+        self.load(key)
+        with self.lock:
+            if self.models[key].backend is not None:
+                self.active = name
+                self.models.move_to_end(key)
+            # The previous voice is idle now; bring the pool back under budget
+            victims = self.evict_locked(0)
+            self.check_budget_locked()
+        self.close_all(victims)
+        return self.active == name
+
+    @property
+    def loaded(self):
+        return self.active is not None
+
+    def convert(self, x, input_rate, pitch_shift):
+        with self.lock:
+            if self.active is None:
+                raise RuntimeError("no active voice")
+            key, speaker_id = self.voices[self.active]
+            entry = self.models[key]
+            backend = entry.backend
+            entry.busy += 1
+            self.models.move_to_end(key)
+        try:
+            y = backend.convert(x, input_rate, pitch_shift, speaker_id)
+            return resample(y, backend.sample_rate, input_rate)
+        finally:
+            with self.lock:
+                entry.busy -= 1
+
+    def close(self):
+        with self.lock:
+            backends = [e.backend for e in self.models.values() if e.backend is not None]
+            for e in self.models.values():
+                e.backend = None
+            self.active = None
+        self.close_all(backends)
+
+
+# ----------- Deadline fallback -------------
+class DeadlineEngine:
+    """
+    Runs `model` (a pool or anything with the same convert()) on its own
+    thread with a per-block deadline. A block is served by `fallback`
+    instead when the model misses the deadline, is still busy with a late
+    block, is not loaded or fails, so LIVE output never drops out. Both
+    return audio at input_rate.
+    """
+    def __init__(self, model, fallback, deadline=0.1):
+        self.model = model
+        self.fallback = fallback
+        self.deadline = deadline
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+        self.misses = 0     # model blocks that ran past the deadline
+        self.fallbacks = 0  # blocks served by the fallback, for any reason
+        self.errors = 0
+        self.last_error = None
+
+    def convert(self, x, input_rate, pitch_shift):
+        if self.model.loaded and (self.pending is None or self.pending.done()):
+            self.pending = self.executor.submit(self.model.convert, x, input_rate, pitch_shift)
+            try:
+                return self.pending.result(timeout=self.deadline)
+            except FutureTimeout:
+                self.misses += 1
+            except Exception as e:
+                self.errors += 1
+                self.last_error = repr(e)
+        self.fallbacks += 1
+        return self.fallback(x, input_rate, pitch_shift)
+
+    def close(self):
+        self.executor.shutdown(wait=False)